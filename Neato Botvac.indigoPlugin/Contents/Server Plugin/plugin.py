@@ -6,12 +6,27 @@ import indigo
 
 import threading
 import queue
+import collections
+import heapq
+import itertools
 import time
 import json
+import random
+import zlib
+import os
+import hashlib
+import struct
+import array
+import datetime
+import concurrent.futures
+import asyncio
+import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 
 try:
-    from pybotvac import Account, Neato, PasswordSession
+    import pybotvac
+    from pybotvac import Neato, PasswordSession
     from pybotvac import Robot
     from pybotvac.exceptions import NeatoException
 except:
@@ -68,8 +83,140 @@ k_robot_cleaning_navigation = {
     2:  'extra_care',
     3:  'deep'
     }
+# status fields: (state key, payload section path, payload key, default, enum)
+k_status_fields = [
+    ('state',            (),                      'state',             0,     k_robot_state),
+    ('action',           (),                      'action',            0,     k_robot_action),
+    ('error',            (),                      'error',             '',    None),
+    ('category',         ('cleaning',),           'category',          0,     k_robot_cleaning_category),
+    ('mode',             ('cleaning',),           'mode',              1,     k_robot_cleaning_mode),
+    ('modifier',         ('cleaning',),           'modifier',          1,     k_robot_cleaning_modifier),
+    ('navigation',       ('cleaning',),           'navigationMode',    1,     k_robot_cleaning_navigation),
+    ('spot_height',      ('cleaning',),           'spotHeight',        0,     None),
+    ('spot_width',       ('cleaning',),           'spotWidth',         0,     None),
+    ('room',             ('cleaning','boundary'), 'name',              '',    None),
+    ('firmware',         ('meta',),               'firmware',          '',    None),
+    ('model',            ('meta',),               'modelName',         '',    None),
+    ('batteryLevel',     ('details',),            'charge',            0,     None),
+    ('charging',         ('details',),            'isCharging',        False, None),
+    ('docked',           ('details',),            'isDocked',          False, None),
+    ('dock_seen',        ('details',),            'dockHasBeenSeen',   False, None),
+    ('schedule_enabled', ('details',),            'isScheduleEnabled', False, None),
+    ]
+# default maximum age of cached informational endpoint results (seconds)
+k_info_max_age = {
+    'schedule'       : 600,
+    'general_info'   : 3600,
+    'local_stats'    : 600,
+    'preferences'    : 3600,
+    'map_boundaries' : 3600,
+    'robot_info'     : 86400,
+    }
+k_cleaning_actions = [
+    'house_cleaning',
+    'spot_cleaning',
+    'manual_cleaning',
+    'map_cleaning',
+    ]
+# states compared to detect plugin events
+k_event_states = ['connected', 'state', 'action', 'docked', 'error', 'batteryLevel']
+k_robot_transitional_actions = [
+    'docking',
+    'suspended_cleaning',
+    'updating',
+    'recovering_location',
+    'suspended_exploration',
+    ]
+# cloud call latency histogram bucket limits (seconds)
+k_latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# history record: time, state, action, battery, charging, docked, mode, room index
+k_history_record = struct.Struct('<IBBBBBBH')
+k_history_codes = {
+    'state'  : {value:code for code, value in k_robot_state.items()},
+    'action' : {value:code for code, value in k_robot_action.items()},
+    'mode'   : {value:code for code, value in k_robot_cleaning_mode.items()},
+    }
+k_history_columns = [
+    ('time',     'L'),
+    ('state',    'B'),
+    ('action',   'B'),
+    ('battery',  'B'),
+    ('charging', 'B'),
+    ('docked',   'B'),
+    ('mode',     'B'),
+    ('room',     'H'),
+    ]
 
 RETRY_CONNECTION_MINUTES = 15
+DEFAULT_WORKER_THREADS = 4
+DEFAULT_POLL_JITTER = 10
+DEFAULT_POLL_STAGGER = 30
+ADAPTIVE_FAST_SECONDS = 15
+ADAPTIVE_SETTLE_SECONDS = 120
+ADAPTIVE_MAX_SECONDS = 3600
+STATUS_TASK = 'status'
+PRIORITY_COMMAND = 0
+PRIORITY_STATUS = 1
+PRIORITY_POLL = 2
+STALE_RETRY_SECONDS = 30
+DEFAULT_FLEET_PARALLEL = 4
+FLEET_WINDOW_SECONDS = 15
+CONFIRM_FIRST_SECONDS = 5
+CONFIRM_TIMEOUT_SECONDS = 120
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 15
+COMMAND_ATTEMPTS = 3
+COMMAND_RETRY_SECONDS = 2
+COMMAND_RECHECK_SECONDS = 5
+COMMAND_STATUS_SECONDS = 60
+ASYNC_TASK_TIMEOUT = 2*(HTTP_CONNECT_TIMEOUT+HTTP_READ_TIMEOUT)
+BREAKER_THRESHOLD = 3
+BREAKER_BASE_SECONDS = 30
+DEFAULT_HISTORY_DAYS = 30
+DEFAULT_BATTERY_THRESHOLD = 20
+BREAKER_MAX_SECONDS = 3600
+
+################################################################################
+def compile_status_fields(fields):
+    # group field specs by payload section so each sub-dict is walked only once
+    sections = collections.OrderedDict()
+    for key, path, field, default, enum in fields:
+        fallback = enum[default] if enum else default
+        sections.setdefault(path, list()).append((key, field, default, enum, fallback))
+    return tuple((path, tuple(specs)) for path, specs in sections.items())
+
+k_status_extractor = compile_status_fields(k_status_fields)
+
+#-------------------------------------------------------------------------------
+def parse_robot_status(robot_status):
+    '''
+    Map a robot state payload to device states in a single pass.
+    Unknown enum codes map to the field's default rather than failing.
+    Returns the states and a list of (state key, unknown code) tuples.
+    '''
+    states  = dict()
+    unknown = list()
+    for path, specs in k_status_extractor:
+        section = robot_status
+        for name in path:
+            section = section.get(name) or {}
+        for key, field, default, enum, fallback in specs:
+            value = section.get(field)
+            if value is None:
+                value = default
+            if enum is not None:
+                if value in enum:
+                    value = enum[value]
+                else:
+                    unknown.append((key, value))
+                    value = fallback
+            states[key] = value
+
+    if states['state'] != 'error':
+        states['error'] = ''
+    if states['category'] == 'room' and not states['room']:
+        states['category'] = 'house'
+    return states, unknown
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -78,9 +225,29 @@ class Plugin(indigo.PluginBase):
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
 
-        self.account = None
+        self.session = None
+        self.session_lock = threading.Lock()
+        self.robot_index = RobotIndex([], 0)
         self.connected = False
+        self.connecting = False
+        self.account_breaker = CircuitBreaker(1, BREAKER_BASE_SECONDS, RETRY_CONNECTION_MINUTES*60)
         self.instance_dict = dict()
+        self.triggers = dict()
+        self.engine = pluginPrefs.get('taskEngine','threads')
+        if self.engine == 'asyncio':
+            self.pool = AsyncTaskEngine(int(pluginPrefs.get('workerThreads',DEFAULT_WORKER_THREADS)), self.logger)
+        else:
+            self.pool = TaskPool(int(pluginPrefs.get('workerThreads',DEFAULT_WORKER_THREADS)), self.logger)
+        self.scheduler = PollScheduler(int(pluginPrefs.get('pollJitter',DEFAULT_POLL_JITTER)),
+                                       int(pluginPrefs.get('pollStagger',DEFAULT_POLL_STAGGER)))
+        self.http = HttpPool(self.pool.size, self.logger)
+        self.http.install()
+        self.fleet = None
+        self.configureFleet(pluginPrefs)
+        self.maps = MapStore(os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins', f'{pluginId}.maps.json'),
+                             self.getPersistentMaps, self.logger)
+        self.history = HistoryRecorder(os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins', f'{pluginId}.history'),
+                                       int(pluginPrefs.get('historyDays',DEFAULT_HISTORY_DAYS)), self.logger)
 
     #-------------------------------------------------------------------------------
     # start, stop and plugin config
@@ -90,11 +257,18 @@ class Plugin(indigo.PluginBase):
         if self.debug:
             self.logger.debug('Debug logging enabled')
 
-        self.updateAccount()
+        # devices start from their last-known states while the account connects
+        self.connecting = True
+        thread = threading.Thread(target=self.connectAccount, name='connectAccount')
+        thread.daemon = True
+        thread.start()
 
     #-------------------------------------------------------------------------------
     def shutdown(self):
         self.pluginPrefs['showDebugInfo'] = self.debug
+        self.pool.stop()
+        if self.fleet:
+            self.fleet.shutdown(wait=False)
 
     #-------------------------------------------------------------------------------
     def validatePrefsConfigUi(self, valuesDict):
@@ -113,65 +287,263 @@ class Plugin(indigo.PluginBase):
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         if not userCancelled:
             self.updateAccount()
+            self.pool.resize(int(valuesDict.get('workerThreads',DEFAULT_WORKER_THREADS)))
+            if valuesDict.get('taskEngine','threads') != self.engine:
+                self.logger.info('Task engine change will take effect when the plugin is restarted')
+            self.http.resize(max(self.pool.size, self.robotCount))
+            self.scheduler.configure(int(valuesDict.get('pollJitter',DEFAULT_POLL_JITTER)),
+                                     int(valuesDict.get('pollStagger',DEFAULT_POLL_STAGGER)))
+            self.configureFleet(valuesDict)
+            self.history.configure(int(valuesDict.get('historyDays',DEFAULT_HISTORY_DAYS)))
             self.debug = valuesDict.get('showDebugInfo',False)
             if self.debug:
                 self.logger.debug('Debug logging enabled')
 
     #-------------------------------------------------------------------------------
     def runConcurrentThread(self):
-        next_connection = time.time() + RETRY_CONNECTION_MINUTES*60
         try:
             while True:
-                loop_time = time.time()
-                for instance in self.instance_dict.values():
-                    instance.task(instance.tick)
-                if not self.connected:
-                    if loop_time > next_connection:
-                        self.updateAccount()
-                        next_connection = loop_time + RETRY_CONNECTION_MINUTES*60
-                self.sleep(5)
+                next_connection = self.account_breaker.retry_time if self.account_breaker.is_open else time.time() + RETRY_CONNECTION_MINUTES*60
+                # the config dialog can replace the fleet pool at any time, so read it once
+                fleet = self.fleet
+                window = FLEET_WINDOW_SECONDS if fleet else 0
+                due = self.scheduler.wait(max(0, next_connection - time.time()), window)
+                if fleet and len(due) > 1:
+                    self.fleetRefresh(fleet, due)
+                else:
+                    for instance in due:
+                        instance.task(instance.request_status, key=STATUS_TASK, priority=PRIORITY_POLL)
+                for instance, func, args in self.scheduler.pop_tasks():
+                    instance.task(func, *args)
+                if self.stopThread:
+                    raise self.StopThread
+                # the startup login runs on its own thread, so never start a second one alongside it
+                if not self.connected and not self.connecting and self.account_breaker.allow():
+                    self.updateAccount(relogin=False)
         except self.StopThread:
             pass
 
+    #-------------------------------------------------------------------------------
+    def configureFleet(self, valuesDict):
+        if self.fleet:
+            self.fleet.shutdown(wait=False)
+            self.fleet = None
+        if valuesDict.get('fleetRefresh',False):
+            size = int(valuesDict.get('fleetParallel',DEFAULT_FLEET_PARALLEL))
+            self.fleet = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix='FleetRefresh')
+
+    #-------------------------------------------------------------------------------
+    def fleetRefresh(self, fleet, instances):
+        # fetch every due robot concurrently; the last fetch to finish hands all results
+        # back in one pass, so this thread never waits on the cloud
+        self.logger.debug(f'Fleet refresh of {len(instances)} robots')
+        started = time.time()
+        results = dict()
+        lock = threading.Lock()
+        def collect(instance, result):
+            with lock:
+                results[instance] = result
+                finished = len(results) == len(instances)
+            if finished:
+                for instance, result in results.items():
+                    if result is None:
+                        instance.task(instance.request_status, key=STATUS_TASK, priority=PRIORITY_POLL)
+                    else:
+                        instance.task(instance.apply_status, *result, priority=PRIORITY_STATUS)
+        def fetched(instance, future):
+            try:
+                result = future.result()
+            except Exception as e:
+                # reported like a cloud error, so the robot keeps polling
+                self.logger.exception(f'"{instance.name}" fleet refresh error \n{e}')
+                result = ({}, e, started)
+            collect(instance, result)
+        for instance in instances:
+            try:
+                future = fleet.submit(instance.fetch_status)
+            except RuntimeError:
+                # the pool was shut down by a config change, so poll this robot on its own
+                collect(instance, None)
+            else:
+                future.add_done_callback(lambda future, instance=instance: fetched(instance, future))
+
+    #-------------------------------------------------------------------------------
+    def stopConcurrentThread(self):
+        super(Plugin, self).stopConcurrentThread()
+        self.scheduler.wake()
+
+    #-------------------------------------------------------------------------------
+    def connectAccount(self):
+        self.updateAccount(relogin=False)
+        self.connecting = False
+        # the account has answered either way, so a robot it doesn't have is offline, not pending;
+        # polls taken while waiting were put off for STALE_RETRY_SECONDS, so start them again
+        for instance in list(self.instance_dict.values()):
+            instance.stale = False
+            instance.states['stale'] = False
+            instance.publish_states()
+            self.scheduler.schedule_first(instance, instance.phase)
+
     #-------------------------------------------------------------------------------
     # menu methods
     #-------------------------------------------------------------------------------
-    def updateAccount(self):
+    def updateAccount(self, relogin=True):
         self.connected = False
         email = self.pluginPrefs.get('email','')
         password = self.pluginPrefs.get('password','')
         if email and password:
             try:
-                password_session = PasswordSession(email=email, password=password, vendor=Neato())
-                self.account = Account(password_session)
-                robots = self.account.robots
+                robots = None
+                if not relogin:
+                    robots = self.restoreAccount(email)
+                if robots is None:
+                    robots = self.loginAccount(email, password)
+                self.robot_index = RobotIndex(robots, self.robot_index.generation + 1)
                 self.connected = True
+                self.account_breaker.success()
+                self.http.resize(max(self.pool.size, len(robots)))
                 self.logger.info('Neato account updated')
+                for instance in list(self.instance_dict.values()):
+                    self.scheduler.schedule_first(instance, instance.phase)
                 if len(robots) > 0:
                     self.logger.info('Robots found:')
-                    for robot in self.account.robots:
+                    for robot in robots:
                         self.logger.info(f'     {robot.name} ({robot.serial})')
                 else:
                     self.logger.error('No robots found')
             except Exception as e:
+                self.robot_index = RobotIndex([], self.robot_index.generation + 1)
+                self.account_breaker.failure()
                 self.logger.error('Error accessing Neato account - check plugin config and internet connection')
                 self.logger.debug(str(e))
+                self.logger.info(f'Retrying Neato account in {self.account_breaker.retry_time - time.time():.0f} seconds')
         else:
-            # plugin is not configured
+            # plugin is not configured, so back off rather than retry on every pass
+            self.robot_index = RobotIndex([], self.robot_index.generation + 1)
+            self.account_breaker.failure()
             self.logger.error('No account credentials - check plugin config')
 
     #-------------------------------------------------------------------------------
-    def getRobotInstance(self, serial):
-        if self.connected:
-            for robot in self.account.robots:
-                if serial == robot.serial:
-                    return robot
-        return None
+    def restoreAccount(self, email):
+        # reuse the cached session token and robot list from the last login
+        token = self.pluginPrefs.get('authToken','')
+        if not token or self.pluginPrefs.get('authEmail','') != email:
+            return None
+        try:
+            session = self.session = restore_session(token, Neato())
+            cache = json.loads(self.pluginPrefs.get('robotCache','[]'))
+            robots = self.createRobots(cache)
+            if len(robots) == len(cache) > 0:
+                self.logger.debug('Neato session restored from cache')
+                return robots
+            # a cached robot failed, so enumerate again with the cached token
+            cache = session.get('users/me/robots').json()
+            self.saveAccountCache(token, email, cache)
+            return self.createRobots(cache)
+        except Exception as e:
+            self.logger.debug(f'Cached Neato session rejected: {e}')
+            return None
+
+    #-------------------------------------------------------------------------------
+    def loginAccount(self, email, password):
+        password_session = self.session = PasswordSession(email=email, password=password, vendor=Neato())
+        cache = password_session.get('users/me/robots').json()
+        token = password_session.headers.get('Authorization','').replace('Token token=','')
+        self.saveAccountCache(token, email, cache)
+        return self.createRobots(cache)
+
+    #-------------------------------------------------------------------------------
+    def createRobots(self, cache):
+        robots = list()
+        for info in cache:
+            try:
+                robots.append(Robot(serial=info['serial'], secret=info['secret_key'], traits=info['traits'],
+                                    vendor=Neato(), name=info['name'], endpoint=info['nucleo_url']))
+            except (NeatoException, RequestException) as e:
+                self.logger.warning(f'Robot {info.get("name")} ({info.get("serial")}) is unavailable')
+                self.logger.debug(str(e))
+        return robots
+
+    #-------------------------------------------------------------------------------
+    def saveAccountCache(self, token, email, cache):
+        keys = ['serial','name','secret_key','traits','nucleo_url']
+        self.pluginPrefs['authToken'] = token
+        self.pluginPrefs['authEmail'] = email
+        self.pluginPrefs['robotCache'] = json.dumps([{key:info.get(key) for key in keys} for info in cache])
+        indigo.server.savePluginPrefs()
+
+    #-------------------------------------------------------------------------------
+    def getRobotIndex(self):
+        return self.robot_index
+
+    #-------------------------------------------------------------------------------
+    def getPersistentMaps(self, serial):
+        # None when offline, so the stored maps are kept rather than emptied
+        if not self.connected:
+            return None
+        # asked per robot, as Account.persistent_maps only covers robots it enumerated itself
+        path = f'users/me/robots/{serial}/persistent_maps'
+        session = self.session
+        try:
+            return session.get(path).json()
+        except (NeatoException, RequestException) as e:
+            if not auth_error(e):
+                raise
+            return self.renewSession(session).get(path).json()
+
+    #-------------------------------------------------------------------------------
+    def renewSession(self, rejected):
+        # the cached token has expired, so log in once for every robot that was using it
+        with self.session_lock:
+            if self.session is rejected:
+                self.logger.info('Neato session expired, logging in again')
+                email = self.pluginPrefs.get('email','')
+                session = PasswordSession(email=email, password=self.pluginPrefs.get('password',''), vendor=Neato())
+                self.pluginPrefs['authToken'] = session.headers.get('Authorization','').replace('Token token=','')
+                self.pluginPrefs['authEmail'] = email
+                indigo.server.savePluginPrefs()
+                self.session = session
+            return self.session
+
+    #-------------------------------------------------------------------------------
+    @property
+    def robotCount(self):
+        return len(self.robot_index)
 
     #-------------------------------------------------------------------------------
     def accountConnected(self):
         return self.connected
 
+    #-------------------------------------------------------------------------------
+    def logRobotMetrics(self):
+        self.logger.info('Robot metrics:')
+        self.logger.info(f'     worker threads: {self.pool.size}')
+        self.logger.info(f'     coalesced status requests: {self.pool.coalesced}')
+        for instance in self.instance_dict.values():
+            self.logger.info(f'     "{instance.name}": {len(instance.queue)} queued (max {instance.max_queue}), {instance.coalesced} coalesced')
+            for line in instance.metrics.report():
+                self.logger.info(f'         {line}')
+
+    #-------------------------------------------------------------------------------
+    def resetRobotMetrics(self):
+        for instance in self.instance_dict.values():
+            instance.metrics.reset()
+        self.logger.info('Robot metrics reset')
+
+    #-------------------------------------------------------------------------------
+    def logCleaningHistory(self, valuesDict, typeId):
+        days = int(valuesDict.get('days','7'))
+        self.logger.info(f'Cleaning history, last {days} days:')
+        for instance in self.instance_dict.values():
+            summary = self.history.summary(instance.serial, time.time() - days*86400)
+            rooms = ', '.join(f'{room} {count}' for room, count in sorted(summary['rooms'].items()))
+            rate = summary['discharge_rate']
+            self.logger.info(f'     "{instance.name}": {summary["runs"]} runs, {summary["cleaning_seconds"]//60} minutes cleaning'
+                             + (f', battery {rate}%/hour' if rate is not None else ''))
+            if rooms:
+                self.logger.info(f'         {rooms}')
+        return True
+
     #-------------------------------------------------------------------------------
     def toggleDebug(self):
         if self.debug:
@@ -191,16 +563,55 @@ class Plugin(indigo.PluginBase):
                 props['version'] = self.pluginVersion
                 dev.replacePluginPropsOnServer(props)
                 dev.stateListOrDisplayStateIdChanged()
-            self.instance_dict[dev.id] = Botvac(dev, self.getRobotInstance, self.logger)
+            self.instance_dict[dev.id] = Botvac(dev, self.getRobotIndex, self.pool, self.scheduler, self.maps, self.history, self.fireEvents, self.logger,
+                                                 stale=self.connecting)
 
 
     #-------------------------------------------------------------------------------
     def deviceStopComm(self, dev):
         if dev.id in self.instance_dict:
-            self.instance_dict[dev.id].cancel()
-            while self.instance_dict[dev.id].is_alive():
-                time.sleep(0.1)
-            del self.instance_dict[dev.id]
+            self.instance_dict.pop(dev.id).cancel()
+
+    #-------------------------------------------------------------------------------
+    # trigger methods
+    #-------------------------------------------------------------------------------
+    def triggerStartProcessing(self, trigger):
+        self.triggers[trigger.id] = trigger
+
+    #-------------------------------------------------------------------------------
+    def triggerStopProcessing(self, trigger):
+        self.triggers.pop(trigger.id, None)
+
+    #-------------------------------------------------------------------------------
+    def validateEventConfigUi(self, valuesDict, typeId, eventId):
+        errorsDict = indigo.Dict()
+
+        if typeId == 'battery_low':
+            if not validateTextFieldNumber(valuesDict['threshold'], numType=int, zero=False, negative=False) \
+               or int(valuesDict['threshold']) > 100:
+                errorsDict['threshold'] = 'Must be an integer from 1 to 100'
+
+        if len(errorsDict) > 0:
+            self.logger.debug(f'validate event config error: \n{errorsDict}')
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def getTriggerDeviceList(self, filter=None, valuesDict=None, typeId='', targetId=0):
+        return [('','Any Robot')] + [(str(devId),instance.name) for devId, instance in self.instance_dict.items()]
+
+    #-------------------------------------------------------------------------------
+    def fireEvents(self, devId, events, previous, current):
+        for trigger in list(self.triggers.values()):
+            if trigger.pluginTypeId not in events:
+                continue
+            if trigger.pluginProps.get('deviceId','') not in ['', str(devId)]:
+                continue
+            if trigger.pluginTypeId == 'battery_low':
+                threshold = int(trigger.pluginProps.get('threshold',DEFAULT_BATTERY_THRESHOLD))
+                if not current['batteryLevel'] < threshold <= previous['batteryLevel']:
+                    continue
+            indigo.trigger.execute(trigger)
 
     #-------------------------------------------------------------------------------
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
@@ -209,13 +620,12 @@ class Plugin(indigo.PluginBase):
         if not valuesDict.get('serial',None):
             errorsDict['serial'] = 'Required'
         else:
-            for robot in self.account.robots:
-                if valuesDict['serial'] == robot.serial:
-                    # valuesDict['secret'] = robot.secret
-                    valuesDict['traits'] = robot.traits
-                    valuesDict['name'] = robot.name
-                    valuesDict['address'] = robot.serial
-                    break
+            robot = self.robot_index.get(valuesDict['serial'])
+            if robot:
+                # valuesDict['secret'] = robot.secret
+                valuesDict['traits'] = robot.traits
+                valuesDict['name'] = robot.name
+                valuesDict['address'] = robot.serial
             else:
                 errorsDict['serial'] = 'Robot not found.  Update account and try again.'
 
@@ -228,13 +638,27 @@ class Plugin(indigo.PluginBase):
     # device config callbacks
     #-------------------------------------------------------------------------------
     def getRobotList(self, filter=None, valuesDict=None, typeId='', targetId=0):
+        if self.connected:
+            return [(robot.serial,robot.name) for robot in self.robot_index.values()]
+        # account offline or still connecting, so use the cached robot list
         try:
-            return [(robot.serial,robot.name) for robot in self.account.robots]
-        except:
-            if targetId != 0:
-                return[(self.instance_dict(targetId).props['name'],self.instance_dict(targetId).props['serial'])]
-            else:
-                return[('**Account Offline**',0)]
+            cache = json.loads(self.pluginPrefs.get('robotCache','[]'))
+        except ValueError:
+            cache = list()
+        if cache:
+            return [(info['serial'],info['name']) for info in cache]
+        elif targetId in self.instance_dict:
+            return [(self.instance_dict[targetId].serial,self.instance_dict[targetId].props.get('name',''))]
+        else:
+            return [('**Account Offline**',0)]
+
+    #-------------------------------------------------------------------------------
+    def getBoundaryList(self, filter=None, valuesDict=None, typeId='', targetId=0):
+        if targetId in self.instance_dict:
+            names = self.maps.boundary_names(self.instance_dict[targetId].serial)
+            if names:
+                return [(name,name) for name in names]
+        return [('','**No Rooms Stored**')]
 
     #-------------------------------------------------------------------------------
     # action methods
@@ -247,6 +671,14 @@ class Plugin(indigo.PluginBase):
                 if not validateTextFieldNumber(valuesDict[key], numType=int, zero=False, negative=False):
                     errorsDict[key] = 'Must be positive integer'
 
+        elif typeId == 'start_room_cleaning':
+            if not valuesDict['room']:
+                errorsDict['room'] = 'Select a room or zone'
+
+        elif typeId in ['get_schedule','get_general_info','get_local_stats','get_preferences','get_map_boundaries','get_robot_info']:
+            if not validateTextFieldNumber(valuesDict['maxAge'], numType=int, zero=True, negative=False):
+                errorsDict['maxAge'] = 'Must be zero or positive integer'
+
         if len(errorsDict) > 0:
             self.logger.debug(f'validate action config error: \n{errorsDict}')
             return (False, valuesDict, errorsDict)
@@ -261,7 +693,7 @@ class Plugin(indigo.PluginBase):
         # STATUS REQUEST
         if action.deviceAction == indigo.kUniversalAction.RequestStatus:
             self.logger.info(f'"{dev.name}" status update')
-            instance.task(instance.request_status)
+            instance.force_status()
         # UNKNOWN
         else:
             self.logger.debug(f'"{dev.name}" {action.deviceAction} request ignored')
@@ -278,6 +710,16 @@ class Plugin(indigo.PluginBase):
         instance = self.instance_dict[action.deviceId]
         instance.task(instance.start_spot_cleaning, action.props)
 
+    #-------------------------------------------------------------------------------
+    def start_room_cleaning(self, action):
+        instance = self.instance_dict[action.deviceId]
+        instance.task(instance.start_room_cleaning, action.props)
+
+    #-------------------------------------------------------------------------------
+    def refresh_maps(self, action):
+        instance = self.instance_dict[action.deviceId]
+        instance.task(instance.sync_maps, True, key='maps')
+
     #-------------------------------------------------------------------------------
     def pause_cleaning(self, action):
         instance = self.instance_dict[action.deviceId]
@@ -308,10 +750,68 @@ class Plugin(indigo.PluginBase):
         instance = self.instance_dict[action.deviceId]
         instance.task(instance.disable_schedule)
 
+    #-------------------------------------------------------------------------------
+    # fleet action callbacks
+    #-------------------------------------------------------------------------------
+    def fleet_start_cleaning(self, action):
+        self.fleetCommand(action, 'start_cleaning', 'start cleaning', action.props)
+
+    #-------------------------------------------------------------------------------
+    def fleet_pause_cleaning(self, action):
+        self.fleetCommand(action, 'pause_cleaning', 'pause cleaning')
+
+    #-------------------------------------------------------------------------------
+    def fleet_stop_cleaning(self, action):
+        self.fleetCommand(action, 'stop_cleaning', 'stop cleaning')
+
+    #-------------------------------------------------------------------------------
+    def fleet_send_to_base(self, action):
+        self.fleetCommand(action, 'send_to_base', 'send to base')
+
+    #-------------------------------------------------------------------------------
+    def fleetCommand(self, action, command, label, *args):
+        # run the command on every selected robot at once, each in its own queue;
+        # the last robot to finish reports for the fleet, so the callback never waits
+        selected = [int(devId) for devId in action.props.get('devices',[])]
+        instances = [instance for devId, instance in self.instance_dict.items() if devId in selected or not selected]
+        results = dict()
+        lock = threading.Lock()
+        def run(instance):
+            result = False
+            try:
+                result = getattr(instance, command)(*args)
+            finally:
+                with lock:
+                    results[instance.name] = None if result is None else bool(result)
+                    finished = len(results) == len(instances)
+                if finished:
+                    self.fleetCommandDone(instances, results, label)
+        for instance in instances:
+            instance.task(run, instance)
+
+    #-------------------------------------------------------------------------------
+    def fleetCommandDone(self, instances, results, label):
+        # robots still retrying report their own outcome later
+        succeeded = sorted(name for name, result in results.items() if result)
+        retrying = sorted(name for name, result in results.items() if result is None)
+        failed = sorted(name for name, result in results.items() if result is False)
+        self.logger.info(f'Fleet {label}: {len(succeeded)} of {len(instances)} robots accepted')
+        if retrying:
+            self.logger.warning(f'Fleet {label} retrying for {", ".join(retrying)}')
+        if failed:
+            self.logger.error(f'Fleet {label} failed for {", ".join(failed)}')
+
+        # confirm every robot in one refresh rather than one poll each
+        when = time.time() + CONFIRM_FIRST_SECONDS
+        for instance in instances:
+            if not instance.cancelled:
+                instance.next_update = when
+                self.scheduler.schedule(instance, when)
+
     #-------------------------------------------------------------------------------
     def get_schedule(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_schedule)
+        instance.task(instance.get_schedule, action.props)
 
     #-------------------------------------------------------------------------------
     def locate(self, action):
@@ -321,41 +821,901 @@ class Plugin(indigo.PluginBase):
     #-------------------------------------------------------------------------------
     def get_general_info(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_general_info)
+        instance.task(instance.get_general_info, action.props)
 
     #-------------------------------------------------------------------------------
     def get_local_stats(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_local_stats)
+        instance.task(instance.get_local_stats, action.props)
 
     #-------------------------------------------------------------------------------
     def get_preferences(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_preferences)
+        instance.task(instance.get_preferences, action.props)
 
     #-------------------------------------------------------------------------------
     def get_map_boundaries(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_map_boundaries)
+        instance.task(instance.get_map_boundaries, action.props)
 
     #-------------------------------------------------------------------------------
     def get_robot_info(self, action):
         instance = self.instance_dict[action.deviceId]
-        instance.task(instance.get_robot_info)
+        instance.task(instance.get_robot_info, action.props)
 
 ###############################################################################
 # Classes
 ###############################################################################
-class Botvac(threading.Thread):
+class HttpPool(object):
+    '''
+    Shared keep-alive connection pool for every Neato cloud call.
+    pybotvac calls requests.get/post directly, so its module references to
+    requests are pointed here and all sessions, accounts and robots reuse
+    the same connections (and TLS sessions) with explicit timeouts.
+    '''
+    exceptions = requests.exceptions
+    auth       = requests.auth
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, size, logger):
+        self.logger  = logger
+        self.session = requests.Session()
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.size    = 0
+        self.resize(size)
+
+    #-------------------------------------------------------------------------------
+    def resize(self, size):
+        size = max(1, size)
+        if size != self.size:
+            self.session.mount('https://', HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=0))
+            self.size = size
+            self.logger.debug(f'HTTP connection pool size {size}')
+
+    #-------------------------------------------------------------------------------
+    def install(self):
+        try:
+            for module in [pybotvac.session, pybotvac.robot, pybotvac.account]:
+                module.requests = self
+        except NameError:
+            pass
+
+    #-------------------------------------------------------------------------------
+    def get(self, url, **kwargs):
+        kwargs['timeout'] = self.timeout
+        return self.session.get(url, **kwargs)
+
+    #-------------------------------------------------------------------------------
+    def post(self, url, **kwargs):
+        kwargs['timeout'] = self.timeout
+        return self.session.post(url, **kwargs)
+
+################################################################################
+class RobotIndex(dict):
+    '''
+    Robots keyed by serial.  A new index is built and swapped in whole on each
+    account update, and its generation tells Botvac when to re-resolve.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, robots, generation):
+        super(RobotIndex, self).__init__((robot.serial, robot) for robot in robots)
+        self.generation = generation
+
+################################################################################
+class CircuitBreaker(object):
+    '''
+    Opens after a number of consecutive failures.  While open, callers skip
+    their calls until the retry time, which backs off exponentially with
+    jitter after each failed probe.  Any success closes it again.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, threshold, base, limit):
+        self.threshold  = threshold
+        self.base       = base
+        self.limit      = limit
+        self.failures   = 0
+        self.retry_time = 0
+
+    #-------------------------------------------------------------------------------
+    @property
+    def is_open(self):
+        return self.failures >= self.threshold
+
+    #-------------------------------------------------------------------------------
+    def allow(self):
+        return not self.is_open or time.time() >= self.retry_time
+
+    #-------------------------------------------------------------------------------
+    def success(self):
+        # returns True if the breaker was open
+        was_open = self.is_open
+        self.failures = 0
+        return was_open
+
+    #-------------------------------------------------------------------------------
+    def failure(self):
+        # returns True if this failure opened the breaker
+        self.failures += 1
+        if self.is_open:
+            delay = min(self.base * 2**(self.failures - self.threshold), self.limit)
+            self.retry_time = time.time() + delay * random.uniform(0.75, 1.25)
+        return self.failures == self.threshold
+
+################################################################################
+class TaskPool(object):
+    '''
+    Fixed number of worker threads shared by all Botvac instances.
+    Each owner keeps its own priority queue and is handed to at most one worker
+    at a time.  Commands run before status requests, which run before scheduled
+    polls; tasks of equal priority run in the order submitted.  Owners wait for
+    a worker at the priority of their most urgent task, so a command is not held
+    behind other robots' polls; when one arrives for an owner already waiting,
+    the owner is queued again and the older entry is skipped.
+    Keyed tasks are idempotent: at most one per key is pending for an owner
+    and further submissions are coalesced into it, raising its priority if needed.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, size, logger):
+        self.logger = logger
+        self.lock   = threading.Lock()
+        self.ready  = queue.PriorityQueue()
+        self.order  = itertools.count()
+        self.size   = 0
+        self.count  = 0
+        self.coalesced = 0
+        self.resize(size)
+
+    #-------------------------------------------------------------------------------
+    def resize(self, size):
+        size = max(1, size)
+        while self.size < size:
+            self.count += 1
+            worker = threading.Thread(target=self.work, name=f'TaskPool-{self.count}')
+            worker.daemon = True
+            worker.start()
+            self.size += 1
+        while self.size > size:
+            self.ready.put((PRIORITY_POLL+1, next(self.order), None))
+            self.size -= 1
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        while self.size > 0:
+            self.ready.put((PRIORITY_POLL+1, next(self.order), None))
+            self.size -= 1
+
+    #-------------------------------------------------------------------------------
+    def register(self, owner):
+        with self.lock:
+            owner.queue     = list()
+            owner.pending   = dict()
+            owner.scheduled = False
+            owner.ticket    = None
+            owner.cancelled = False
+            owner.coalesced = 0
+            owner.max_queue = 0
+
+    #-------------------------------------------------------------------------------
+    def unregister(self, owner):
+        with self.lock:
+            owner.cancelled = True
+            owner.queue.clear()
+            owner.pending.clear()
+
+    #-------------------------------------------------------------------------------
+    def submit(self, owner, func, args, key=None, priority=PRIORITY_COMMAND):
+        with self.lock:
+            if owner.cancelled:
+                return
+            if key:
+                if key in owner.pending:
+                    self.count_coalesced(owner)
+                    if owner.pending[key] <= priority:
+                        return
+                    self.remove(owner, key)
+                owner.pending[key] = priority
+            heapq.heappush(owner.queue, (priority, next(self.order), func, args, key, time.time()))
+            owner.max_queue = max(owner.max_queue, len(owner.queue))
+            if not owner.scheduled:
+                owner.scheduled = True
+                self.dispatch(owner)
+            elif owner.ticket is not None and priority < owner.ticket[0]:
+                # still waiting for a worker, so move it up
+                self.dispatch(owner)
+
+    #-------------------------------------------------------------------------------
+    def dispatch(self, owner):
+        # call with lock held; only the owner's latest ticket is serviced
+        owner.ticket = (owner.queue[0][0], next(self.order))
+        self.ready.put(owner.ticket + (owner,))
+
+    #-------------------------------------------------------------------------------
+    def next_item(self, owner):
+        # call with lock held
+        item = heapq.heappop(owner.queue) if owner.queue else None
+        if item and item[4]:
+            del owner.pending[item[4]]
+        return item
+
+    #-------------------------------------------------------------------------------
+    def remove(self, owner, key):
+        # call with lock held
+        owner.queue = [item for item in owner.queue if item[4] != key]
+        heapq.heapify(owner.queue)
+        del owner.pending[key]
+
+    #-------------------------------------------------------------------------------
+    def work(self):
+        while True:
+            priority, order, owner = self.ready.get()
+            if owner is None:
+                break
+            with self.lock:
+                if owner.ticket != (priority, order):
+                    continue
+                owner.ticket = None
+                item = self.next_item(owner)
+            if item:
+                owner.execute(item[2], item[3], item[5])
+            with self.lock:
+                if owner.queue and not owner.cancelled:
+                    self.dispatch(owner)
+                else:
+                    owner.scheduled = False
+
+    #-------------------------------------------------------------------------------
+    def discard(self, owner, key, priority=PRIORITY_COMMAND):
+        # a fresher task with this key is running now, so a pending one is redundant
+        with self.lock:
+            if owner.pending.get(key, -1) >= priority:
+                self.remove(owner, key)
+                self.count_coalesced(owner)
+
+    #-------------------------------------------------------------------------------
+    def count_coalesced(self, owner):
+        owner.coalesced += 1
+        self.coalesced  += 1
+
+################################################################################
+class AsyncTaskEngine(TaskPool):
+    '''
+    Optional alternative to the worker threads: each robot's task queue is
+    drained by a coroutine on one background event loop, which owns ordering,
+    per-task timeouts and cancellation.  pybotvac is blocking, so the cloud
+    calls themselves run in a bounded executor.  A call that outlives its
+    timeout is logged and the robot's queue waits for it to return, so one
+    robot's calls never overlap.  Unregistering a robot cancels its coroutine
+    at once; an abandoned call finishes in the executor and its result is
+    ignored.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, size, logger):
+        self.executor = None
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, name='AsyncTaskEngine')
+        thread.daemon = True
+        thread.start()
+        super(AsyncTaskEngine, self).__init__(size, logger)
+
+    #-------------------------------------------------------------------------------
+    def resize(self, size):
+        size = max(1, size)
+        if size != self.size:
+            previous = self.executor
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix='AsyncTaskEngine')
+            self.size = size
+            if previous:
+                previous.shutdown(wait=False)
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        self.size = 0
+
+    #-------------------------------------------------------------------------------
+    def unregister(self, owner):
+        super(AsyncTaskEngine, self).unregister(owner)
+        consumer = getattr(owner, 'consumer', None)
+        if consumer:
+            self.loop.call_soon_threadsafe(consumer.cancel)
+
+    #-------------------------------------------------------------------------------
+    def dispatch(self, owner):
+        self.loop.call_soon_threadsafe(self.start_consumer, owner)
+
+    #-------------------------------------------------------------------------------
+    def start_consumer(self, owner):
+        owner.consumer = self.loop.create_task(self.consume(owner))
+
+    #-------------------------------------------------------------------------------
+    async def consume(self, owner):
+        try:
+            while True:
+                with self.lock:
+                    item = None if owner.cancelled else self.next_item(owner)
+                    if not item:
+                        owner.scheduled = False
+                        owner.consumer  = None
+                        return
+                priority, order, func, args, key, queued = item
+                call = self.loop.run_in_executor(self.executor, owner.execute, func, args, queued)
+                try:
+                    await asyncio.wait_for(asyncio.shield(call), ASYNC_TASK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.logger.error(f'"{owner.name}" task "{func.__name__}" timed out')
+                    # the call can't be interrupted, so hold the queue until it returns
+                    await call
+        except asyncio.CancelledError:
+            with self.lock:
+                owner.scheduled = False
+                owner.consumer  = None
+
+################################################################################
+class PollScheduler(object):
+    '''
+    Heap of each robot's next status poll.  The concurrent thread sleeps until
+    the earliest deadline and dispatches only the polls that are due.
+    Rescheduling leaves the old heap entry in place; it is discarded when popped.
+    First polls are spread over the stagger window by each robot's phase and
+    later polls are randomly jittered so robots never hit the cloud in lockstep.
+    One-off delayed tasks, such as command retries, wait in a second heap and
+    are handed to the robot's task queue once due.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, jitter, stagger):
+        self.cond  = threading.Condition()
+        self.heap  = list()
+        self.tasks = list()
+        self.due   = dict()
+        self.count = 0
+        self.configure(jitter, stagger)
+
+    #-------------------------------------------------------------------------------
+    def configure(self, jitter, stagger):
+        self.jitter  = max(0, min(jitter, 50)) / 100
+        self.stagger = max(0, stagger)
+
+    #-------------------------------------------------------------------------------
+    def schedule_first(self, owner, phase):
+        when = time.time() + phase * self.stagger
+        self.schedule(owner, when)
+        return when
+
+    #-------------------------------------------------------------------------------
+    def schedule_after(self, owner, interval):
+        when = time.time() + interval * (1 + random.uniform(-self.jitter, self.jitter))
+        self.schedule(owner, when)
+        return when
+
+    #-------------------------------------------------------------------------------
+    def schedule(self, owner, when):
+        with self.cond:
+            self.count += 1
+            self.due[owner] = when
+            heapq.heappush(self.heap, (when, self.count, owner))
+            self.cond.notify()
+
+    #-------------------------------------------------------------------------------
+    def schedule_task(self, owner, when, func, *args):
+        with self.cond:
+            self.count += 1
+            heapq.heappush(self.tasks, (when, self.count, owner, func, args))
+            self.cond.notify()
+
+    #-------------------------------------------------------------------------------
+    def unschedule(self, owner):
+        with self.cond:
+            self.due.pop(owner, None)
+            self.tasks = [item for item in self.tasks if item[2] is not owner]
+            heapq.heapify(self.tasks)
+
+    #-------------------------------------------------------------------------------
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    #-------------------------------------------------------------------------------
+    def wait(self, limit, window=0):
+        # window pulls in polls that are nearly due so they can be batched
+        with self.cond:
+            self.discard_stale()
+            timeout = limit
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - time.time())
+            if self.tasks:
+                timeout = min(timeout, self.tasks[0][0] - time.time())
+            if timeout > 0:
+                self.cond.wait(timeout)
+            if self.heap and self.heap[0][0] <= time.time():
+                return self.pop_due(time.time() + window)
+            return list()
+
+    #-------------------------------------------------------------------------------
+    def pop_due(self, now):
+        owners = list()
+        self.discard_stale()
+        while self.heap and self.heap[0][0] <= now:
+            when, count, owner = heapq.heappop(self.heap)
+            del self.due[owner]
+            owners.append(owner)
+            self.discard_stale()
+        return owners
+
+    #-------------------------------------------------------------------------------
+    def pop_tasks(self):
+        tasks = list()
+        with self.cond:
+            while self.tasks and self.tasks[0][0] <= time.time():
+                when, count, owner, func, args = heapq.heappop(self.tasks)
+                tasks.append((owner, func, args))
+        return tasks
+
+    #-------------------------------------------------------------------------------
+    def discard_stale(self):
+        while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+################################################################################
+class CloudMetrics(object):
+    '''
+    One robot's cloud call counts, failures by exception type and latency
+    histogram per endpoint, plus how long its tasks waited in the queue.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    #-------------------------------------------------------------------------------
+    def reset(self):
+        with self.lock:
+            self.endpoints = dict()
+            self.last_latency = 0
+            self.waits = 0
+            self.wait_total = 0
+            self.wait_max = 0
+
+    #-------------------------------------------------------------------------------
+    def measure(self, endpoint, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(endpoint, time.perf_counter() - started, self.error_name(e))
+            raise
+        self.record(endpoint, time.perf_counter() - started)
+        return result
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def error_name(error):
+        for kind in (NeatoException, RequestException, KeyError):
+            if isinstance(error, kind):
+                return kind.__name__
+        return type(error).__name__
+
+    #-------------------------------------------------------------------------------
+    def record(self, endpoint, seconds, error=None):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'calls'    : 0,
+                'failures' : collections.Counter(),
+                'total'    : 0,
+                'max'      : 0,
+                'buckets'  : [0]*(len(k_latency_buckets)+1),
+                })
+            stats['calls'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][next((i for i, limit in enumerate(k_latency_buckets) if seconds <= limit), -1)] += 1
+            if error:
+                stats['failures'][error] += 1
+            if endpoint == 'state':
+                self.last_latency = seconds
+
+    #-------------------------------------------------------------------------------
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def percentile(stats, fraction):
+        # upper limit of the histogram bucket holding the given fraction of calls
+        target = stats['calls'] * fraction
+        count = 0
+        for limit, bucket in zip(k_latency_buckets + [None], stats['buckets']):
+            count += bucket
+            if count >= target:
+                return limit
+        return None
+
+    #-------------------------------------------------------------------------------
+    def summary(self):
+        with self.lock:
+            return {
+                'cloud_latency'  : round(self.last_latency*1000),
+                'cloud_calls'    : sum(stats['calls'] for stats in self.endpoints.values()),
+                'cloud_failures' : sum(sum(stats['failures'].values()) for stats in self.endpoints.values()),
+                'queue_wait'     : round(self.wait_total*1000/self.waits) if self.waits else 0,
+                }
 
     #-------------------------------------------------------------------------------
-    def __init__(self, device, getRobotInstance, logger):
-        super(Botvac, self).__init__()
-        self.daemon     = True
-        self.cancelled  = False
-        self.queue      = queue.Queue()
+    def report(self):
+        lines = list()
+        with self.lock:
+            if self.waits:
+                lines.append(f'queue wait: mean {self.wait_total*1000/self.waits:.0f}ms, max {self.wait_max*1000:.0f}ms')
+            for endpoint, stats in sorted(self.endpoints.items()):
+                p95 = self.percentile(stats, 0.95)
+                line = (f'{endpoint}: {stats["calls"]} calls, mean {stats["total"]*1000/stats["calls"]:.0f}ms, '
+                        f'p95 {"<"+str(int(p95*1000))+"ms" if p95 else ">"+str(k_latency_buckets[-1])+"s"}, '
+                        f'max {stats["max"]*1000:.0f}ms')
+                if stats['failures']:
+                    line += ', failed ' + ', '.join(f'{name} {count}' for name, count in stats['failures'].most_common())
+                lines.append(line)
+        return lines
+
+################################################################################
+class MeteredRobot(object):
+    '''
+    Wraps a pybotvac Robot so every cloud call is timed and counted.
+    '''
 
-        self.getRobot = getRobotInstance
+    #-------------------------------------------------------------------------------
+    def __init__(self, robot, metrics):
+        self._robot = robot
+        self._metrics = metrics
+
+    #-------------------------------------------------------------------------------
+    @property
+    def state(self):
+        return self._metrics.measure('state', getattr, self._robot, 'state')
+
+    #-------------------------------------------------------------------------------
+    def __getattr__(self, name):
+        attr = getattr(self._robot, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            return self._metrics.measure(name, attr, *args, **kwargs)
+        return call
+
+################################################################################
+class MapStore(object):
+    '''
+    Persistent maps and their boundaries for every robot, keyed by serial and
+    map id, with a content hash per map.  Saved to disk so room and zone names
+    resolve to boundary ids without cloud calls.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, path, getPersistentMaps, logger):
+        self.path = path
+        self.getPersistentMaps = getPersistentMaps
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.robots = dict()
+        self.load()
+
+    #-------------------------------------------------------------------------------
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.robots = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.error(f'unable to read map store: {e}')
+
+    #-------------------------------------------------------------------------------
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path+'.tmp', 'w') as f:
+                json.dump(self.robots, f, sort_keys=True)
+            os.replace(self.path+'.tmp', self.path)
+        except OSError as e:
+            self.logger.error(f'unable to write map store: {e}')
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def digest(map_info):
+        # signed download urls change on every request, so leave them out
+        content = {key:value for key, value in map_info.items() if 'url' not in key}
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    #-------------------------------------------------------------------------------
+    def known(self, serial, map_id, boundary_id=None):
+        with self.lock:
+            stored = self.robots.get(serial, {}).get(str(map_id))
+            if stored is None:
+                return False
+            return not boundary_id or any(b.get('id') == boundary_id for b in stored['boundaries'])
+
+    #-------------------------------------------------------------------------------
+    def sync(self, serial, getBoundaries, force=False):
+        persistent_maps = self.getPersistentMaps(serial)
+        if persistent_maps is None:
+            # offline, so keep what is stored
+            return 0
+        maps = {str(info.get('id')):info for info in persistent_maps}
+        with self.lock:
+            stored = self.robots.get(serial, {})
+        updated = dict()
+        changed = set(stored) - set(maps)
+        for map_id, info in maps.items():
+            digest = self.digest(info)
+            if not force and map_id in stored and stored[map_id]['hash'] == digest:
+                updated[map_id] = stored[map_id]
+                continue
+            updated[map_id] = {
+                'name'       : info.get('name',''),
+                'hash'       : digest,
+                'boundaries' : getBoundaries(map_id),
+                }
+            changed.add(map_id)
+        if changed:
+            with self.lock:
+                self.robots[serial] = updated
+                self.save()
+        return len(changed)
+
+    #-------------------------------------------------------------------------------
+    def set_boundaries(self, serial, map_id, boundaries):
+        with self.lock:
+            stored = self.robots.get(serial, {}).get(str(map_id))
+            if stored is not None and stored['boundaries'] != boundaries:
+                stored['boundaries'] = boundaries
+                self.save()
+
+    #-------------------------------------------------------------------------------
+    def resolve(self, serial, name):
+        # returns (map id, boundary id) for a room or zone name, or None
+        with self.lock:
+            for map_id, stored in self.robots.get(serial, {}).items():
+                for boundary in stored['boundaries']:
+                    if boundary.get('type') == 'polygon' and boundary.get('name','').lower() == name.lower():
+                        return map_id, boundary.get('id')
+        return None
+
+    #-------------------------------------------------------------------------------
+    def boundary_names(self, serial):
+        with self.lock:
+            return sorted({boundary.get('name','') for stored in self.robots.get(serial, {}).values()
+                           for boundary in stored['boundaries']
+                           if boundary.get('type') == 'polygon' and boundary.get('name')})
+
+################################################################################
+class HistoryRecorder(object):
+    '''
+    Polled status history for every robot.  Each robot gets an append-only
+    file of fixed-size records loaded into column arrays, plus a room name
+    table.  Records past the retention period are folded into daily rollups.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, folder, days, logger):
+        self.folder = folder
+        self.days = days
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.series = dict()
+
+    #-------------------------------------------------------------------------------
+    def configure(self, days):
+        with self.lock:
+            self.days = days
+            for series in self.series.values():
+                series.next_compact = 0
+
+    #-------------------------------------------------------------------------------
+    def get_series(self, serial):
+        # callers hold the lock
+        if serial not in self.series:
+            self.series[serial] = HistorySeries(os.path.join(self.folder, serial), self.logger)
+        return self.series[serial]
+
+    #-------------------------------------------------------------------------------
+    def record(self, serial, states, when):
+        with self.lock:
+            series = self.get_series(serial)
+            series.append(int(when), states)
+            if self.days and when >= series.next_compact:
+                series.compact(int(when) - self.days*86400)
+                series.next_compact = when + 86400
+
+    #-------------------------------------------------------------------------------
+    def summary(self, serial, since):
+        with self.lock:
+            series = self.get_series(serial)
+            runs = series.runs(since)
+            curve = series.battery_curve(since)
+            rollups = {day:rollup for day, rollup in series.rollups.items()
+                       if day >= datetime.date.fromtimestamp(since).isoformat()}
+        rooms = collections.Counter(room or 'house' for start, end, room in runs)
+        cleaning = sum(end - start for start, end, room in runs)
+        for rollup in rollups.values():
+            rooms.update(rollup['rooms'])
+            cleaning += rollup['cleaning_seconds']
+        return {
+            'runs'             : sum(rooms.values()),
+            'cleaning_seconds' : cleaning,
+            'rooms'            : dict(rooms),
+            'discharge_rate'   : HistorySeries.discharge_rate(curve),
+            }
+
+################################################################################
+class HistorySeries(object):
+    '''
+    One robot's history: column arrays mirrored by an append-only record file.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        self.columns = {name:array.array(code) for name, code in k_history_columns}
+        self.rooms = ['']
+        self.room_index = {'':0}
+        self.rollups = dict()
+        self.next_compact = 0
+        self.loaded = False
+        self.load()
+
+    #-------------------------------------------------------------------------------
+    def load(self):
+        # each file is read on its own, and a missing one simply has nothing in it yet
+        rooms = self.read('.rooms', 'r')
+        if rooms:
+            for name in rooms.split('\n')[1:]:
+                self.room_index[name] = len(self.rooms)
+                self.rooms.append(name)
+        rollups = self.read('.rollups', 'r')
+        if rollups:
+            try:
+                self.rollups = json.loads(rollups)
+            except ValueError as e:
+                self.logger.error(f'unable to read history {self.path}: {e}')
+        data = self.read('.history', 'rb')
+        if data is None:
+            return
+        self.loaded = True
+        # a partial record from an interrupted write is dropped
+        data = data[:len(data) - len(data) % k_history_record.size]
+        for record in k_history_record.iter_unpack(data):
+            for (name, code), value in zip(k_history_columns, record):
+                self.columns[name].append(value)
+
+    #-------------------------------------------------------------------------------
+    def read(self, name, mode):
+        # returns empty content for a missing file and None if it can't be read
+        try:
+            with open(self.path+name, mode) as f:
+                return f.read()
+        except FileNotFoundError:
+            return b'' if 'b' in mode else ''
+        except OSError as e:
+            self.logger.error(f'unable to read history {self.path}: {e}')
+            return None
+
+    #-------------------------------------------------------------------------------
+    def write(self, name, mode, data):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path+name, mode) as f:
+                f.write(data)
+        except OSError as e:
+            self.logger.error(f'unable to write history {self.path}: {e}')
+
+    #-------------------------------------------------------------------------------
+    def append(self, when, states):
+        room = states['room']
+        if room not in self.room_index:
+            self.room_index[room] = len(self.rooms)
+            self.rooms.append(room)
+            self.write('.rooms', 'w', '\n'.join(self.rooms))
+        record = (
+            when,
+            k_history_codes['state'].get(states['state'], 0),
+            k_history_codes['action'].get(states['action'], 0),
+            max(0, min(255, int(states['batteryLevel']))),
+            bool(states['charging']),
+            bool(states['docked']),
+            k_history_codes['mode'].get(states['mode'], 0),
+            self.room_index[room],
+            )
+        for (name, code), value in zip(k_history_columns, record):
+            self.columns[name].append(value)
+        self.write('.history', 'ab', k_history_record.pack(*record))
+
+    #-------------------------------------------------------------------------------
+    def compact(self, cutoff):
+        # never rewrite a record file that couldn't be read
+        if not self.loaded:
+            return
+        times = self.columns['time']
+        keep = next((i for i, t in enumerate(times) if t >= cutoff), len(times))
+        if not keep:
+            return
+        for start, end, room in self.runs(0, keep):
+            rollup = self.rollups.setdefault(datetime.date.fromtimestamp(start).isoformat(),
+                                             {'runs':0, 'cleaning_seconds':0, 'rooms':{}})
+            rollup['runs'] += 1
+            rollup['cleaning_seconds'] += end - start
+            rollup['rooms'][room or 'house'] = rollup['rooms'].get(room or 'house', 0) + 1
+        for name, code in k_history_columns:
+            del self.columns[name][:keep]
+        records = zip(*(self.columns[name] for name, code in k_history_columns))
+        self.write('.rollups', 'w', json.dumps(self.rollups, sort_keys=True))
+        self.write('.history.tmp', 'wb', b''.join(k_history_record.pack(*record) for record in records))
+        try:
+            os.replace(self.path+'.history.tmp', self.path+'.history')
+        except OSError as e:
+            self.logger.error(f'unable to write history {self.path}: {e}')
+
+    #-------------------------------------------------------------------------------
+    def runs(self, since, stop=None):
+        # cleaning runs as (start, end, room); a run lasts while busy or paused
+        active = {k_history_codes['state']['busy'], k_history_codes['state']['paused']}
+        times, states, rooms = self.columns['time'], self.columns['state'], self.columns['room']
+        stop = len(times) if stop is None else stop
+        runs = list()
+        start = room = None
+        for i in range(stop):
+            if times[i] < since:
+                continue
+            if states[i] in active:
+                if start is None:
+                    start, room = times[i], ''
+                room = room or self.rooms[rooms[i]]
+            elif start is not None:
+                runs.append((start, times[i], room))
+                start = None
+        return runs
+
+    #-------------------------------------------------------------------------------
+    def battery_curve(self, since):
+        # (time, battery) samples taken off the dock
+        columns = self.columns
+        return [(t, b) for t, b, c, d in zip(columns['time'], columns['battery'], columns['charging'], columns['docked'])
+                if t >= since and not c and not d]
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def discharge_rate(curve):
+        # average percent per hour over consecutive falling samples
+        drop = seconds = 0
+        for (t0, b0), (t1, b1) in zip(curve, curve[1:]):
+            if b1 < b0 and t1 > t0:
+                drop += b0 - b1
+                seconds += t1 - t0
+        return round(drop*3600/seconds, 1) if seconds else None
+
+################################################################################
+class Botvac(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, device, getRobotIndex, pool, scheduler, maps, history, fireEvents, logger, stale=False):
+        self.pool = pool
+        self.pool.register(self)
+        self.scheduler = scheduler
+        self.maps = maps
+        self.history = history
+        self.fireEvents = fireEvents
+
+        self.getRobotIndex = getRobotIndex
+        self.robot = None
+        self.generation = None
         self.logger = logger
 
         self.device = device
@@ -363,6 +1723,8 @@ class Botvac(threading.Thread):
         self.serial = self.props.get('serial','')
         self.frequency_idle = int(self.props.get('statusFrequency','300'))
         self.frequency_busy = int(self.props.get('statusFrequencyBusy',self.frequency_idle))
+        self.phase = zlib.crc32(self.serial.encode('utf-8')) / 0x100000000
+        self.adaptive = self.props.get('adaptiveFrequency',False)
 
         self.states = {
             'state'            : k_robot_state[0],
@@ -374,6 +1736,7 @@ class Botvac(threading.Thread):
             'navigation'       : 1,
             'spot_height'      : 0,
             'spot_width'       : 0,
+            'room'             : '',
             'firmware'         : '',
             'model'            : '',
             'batteryLevel'     : 0,
@@ -382,124 +1745,339 @@ class Botvac(threading.Thread):
             'dock_seen'        : False,
             'schedule_enabled' : False,
             'connected'        : False,
+            'stale'            : False,
             'display'          : 'offline',
+            'last_command'     : '',
+            'command_result'   : 'none',
             }
+        for endpoint in k_info_max_age:
+            self.states[f'{endpoint}_data'] = ''
+        if self.props.get('metricStates',False):
+            self.states.update({
+                'cloud_latency'  : 0,
+                'cloud_calls'    : 0,
+                'cloud_failures' : 0,
+                'queue_wait'     : 0,
+                })
         self.available_commands = dict()
         self.next_update = 0
+        self.status_time = 0
+        self.command_time = 0
+        self.backoff = 1
         self.error = False
-
-        self.task(self.request_status)
-        self.start()
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, self.frequency_idle, BREAKER_MAX_SECONDS)
+        self.maps_breaker = CircuitBreaker(1, BREAKER_BASE_SECONDS, BREAKER_MAX_SECONDS)
+        self.metrics = CloudMetrics()
+        self.metric_states = self.props.get('metricStates',False)
+        self.published = dict()
+        self.published_image = None
+        self.force_update = False
+        self.info_cache = dict()
+        self.expected = dict()
+        self.expect_from = dict()
+        self.expect_deadline = 0
+        self.confirm_delay = CONFIRM_FIRST_SECONDS
+        self.hydrate(stale)
+
+        self.logger.debug(f'"{self.name}" registered')
+        self.next_update = self.scheduler.schedule_first(self, self.phase)
 
     #-------------------------------------------------------------------------------
-    def run(self):
-        self.logger.debug(f'"{self.name}" thread started')
-        while not self.cancelled:
-            try:
-                func, args = self.queue.get(True,2)
-                try:
-                    func(*args)
-                except NotImplementedError:
-                    self.logger.error(f'"{self.name}" task "{func.__name__}" not implemented')
-                self.queue.task_done()
-            except queue.Empty:
-                pass
-            except Exception as e:
-                self.logger.exception(f'"{self.name}" thread error \n{e}')
-        else:
-            self.logger.debug(f'"{self.name}" thread cancelled')
+    def execute(self, func, args, queued=None):
+        if self.cancelled:
+            return
+        if queued:
+            self.metrics.record_wait(time.time() - queued)
+        try:
+            func(*args)
+        except NotImplementedError:
+            self.logger.error(f'"{self.name}" task "{func.__name__}" not implemented')
+        except Exception as e:
+            self.logger.exception(f'"{self.name}" task error \n{e}')
 
     #-------------------------------------------------------------------------------
-    def task(self, func, *args):
-        self.queue.put((func, args))
-        # func(*args)
+    def task(self, func, *args, key=None, priority=PRIORITY_COMMAND):
+        self.pool.submit(self, func, args, key, priority)
 
     #-------------------------------------------------------------------------------
     def cancel(self):
-        self.cancelled = True
-
-    #-------------------------------------------------------------------------------
-    def tick(self):
-        if time.time() >= self.next_update:
-            self.request_status()
+        self.pool.unregister(self)
+        self.scheduler.unschedule(self)
+        self.logger.debug(f'"{self.name}" cancelled')
 
     #-------------------------------------------------------------------------------
     def request_status(self):
+        self.pool.discard(self, STATUS_TASK)
         self.logger.info(f'"{self.name}" request status')
-        robot_status = {}
+        self.apply_status(*self.fetch_status())
+
+    #-------------------------------------------------------------------------------
+    def fetch_status(self):
+        # only the cloud call, so fleet refreshes can run it outside the task queue
+        started = time.time()
+        index = self.getRobotIndex()
+        if index.generation != self.generation:
+            robot = index.get(self.serial)
+            self.robot = MeteredRobot(robot, self.metrics) if robot else None
+            self.generation = index.generation
+        robot = self.robot
+        if not robot:
+            return None, None, started
+        try:
+            return robot.state, None, started
+        except (NeatoException, RequestException) as e:
+            return {}, e, started
 
-        self.robot = self.getRobot(self.serial)
-        if not self.robot:
+    #-------------------------------------------------------------------------------
+    def apply_status(self, robot_status, error, started):
+        if started < self.status_time:
+            self.logger.debug(f'"{self.name}" discarded status older than last update')
+            return
+        self.status_time = started
+        self.pool.discard(self, STATUS_TASK, PRIORITY_POLL)
+        previous = self.transition_key
+
+        reported = None
+        if robot_status is None and self.stale:
+            self.logger.debug(f'"{self.name}" waiting for account')
+            interval = STALE_RETRY_SECONDS
+        elif robot_status is None:
+            reported = {'connected':False}
             self.device.setErrorStateOnServer('offline')
             self.error = True
             self.logger.error(f'"{self.name}" offline')
             self.available_commands = {}
+            interval = self.frequency_idle
         else:
             if self.error:
                 self.device.setErrorStateOnServer(None)
                 self.error = False
                 self.logger.info(f'"{self.name}" online')
-
-            try:
-                robot_status = self.robot.state
-
-                self.states['state']            = k_robot_state[robot_status.get('state',0)]
-                self.states['action']           = k_robot_action[robot_status.get('action',0)]
-                self.states['error']            = robot_status.get('error','') if self.states['state']=='error' else ''
-                self.states['room']             = robot_status.get('cleaning',{}).get('boundary',{}).get('name','')
-                self.states['category']         = k_robot_cleaning_category[robot_status.get('cleaning',{}).get('category',0)]
-                self.states['mode']             = k_robot_cleaning_mode[robot_status.get('cleaning',{}).get('mode',1)]
-                self.states['modifier']         = k_robot_cleaning_modifier[robot_status.get('cleaning',{}).get('modifier',1)]
-                self.states['navigation']       = k_robot_cleaning_navigation[robot_status.get('cleaning',{}).get('navigationMode',1)]
-                self.states['spot_height']      = robot_status.get('cleaning',{}).get('spotHeight',0)
-                self.states['spot_width']       = robot_status.get('cleaning',{}).get('spotWidth',0)
-                self.states['firmware']         = robot_status.get('meta',{}).get('firmware','')
-                self.states['model']            = robot_status.get('meta',{}).get('modelName','')
-                self.states['batteryLevel']     = robot_status.get('details',{}).get('charge',0)
-                self.states['charging']         = robot_status.get('details',{}).get('isCharging',False)
-                self.states['docked']           = robot_status.get('details',{}).get('isDocked',False)
-                self.states['dock_seen']        = robot_status.get('details',{}).get('dockHasBeenSeen',False)
-                self.states['schedule_enabled'] = robot_status.get('details',{}).get('isScheduleEnabled',False)
-                self.available_commands         = robot_status.get('availableCommands',{})
-
-                self.logger.debug(f'"{self.name}" available commands: {self.available_commands}')
-
-                self.states['connected'] = True
-
-            except NeatoException as e:
-                self.logger.error(f'{e}')
-                self.logger.info(f'"{self.name}" offline')
-                self.states['connected'] = False
-            except KeyError:
-                self.logger.error(f'"{self.name}" received unexpected status message')
-                self.logger.debug(f'{json.dumps(robot_status, sort_keys=True, indent=4)}')
+            self.stale = False
+            self.states['stale'] = False
+
+            if error:
+                if self.breaker.failure():
+                    self.logger.error(f'"{self.name}" repeated cloud errors, backing off')
+                if self.breaker.failures <= self.breaker.threshold:
+                    self.logger.error(f'{error}')
+                    self.logger.info(f'"{self.name}" offline')
+                else:
+                    self.logger.debug(f'"{self.name}" still offline: {error}')
                 self.states['connected'] = False
+                reported = {'connected':False}
+            else:
+                if self.breaker.success():
+                    self.logger.info(f'"{self.name}" cloud connection recovered')
+                try:
+                    states, unknown = parse_robot_status(robot_status)
+                    for key, code in unknown:
+                        self.logger.warning(f'"{self.name}" unknown {key} code {code}')
+                    # events follow what the robot reported, not states shown while confirming
+                    reported = dict(states, connected=True)
+                    self.check_expected(states)
+                    self.states.update(states)
+                    self.available_commands = robot_status.get('availableCommands') or {}
+                    self.check_map(robot_status)
+
+                    self.logger.debug(f'"{self.name}" available commands: {self.available_commands}')
+
+                    self.states['connected'] = True
+                    self.history.record(self.serial, self.states, started)
+
+                except (AttributeError, TypeError):
+                    self.logger.error(f'"{self.name}" received unexpected status message')
+                    self.logger.debug(f'{json.dumps(robot_status, sort_keys=True, indent=4)}')
+                    self.states['connected'] = False
+                    reported = {'connected':False}
+
+            self.update_display()
+            interval = self.next_interval(self.transition_key != previous)
+            if self.expected:
+                interval = self.confirm_delay
+                self.confirm_delay *= 2
+
+            if self.metric_states:
+                self.states.update(self.metrics.summary())
+            self.publish_states(self.force_update)
+            self.force_update = False
+
+        if reported:
+            self.detect_events(reported)
+
+        if self.cancelled:
+            pass
+        elif self.breaker.is_open:
+            self.next_update = self.breaker.retry_time
+            self.scheduler.schedule(self, self.next_update)
+        else:
+            self.next_update = self.scheduler.schedule_after(self, interval)
+        self.logger.debug(f'"{self.name}" status update complete')
 
-            if self.states['category'] == 'room' and not self.states['room']:
-                self.states['category'] = 'house'
+    #-------------------------------------------------------------------------------
+    def check_map(self, robot_status):
+        # only go to the cloud for maps when the robot reports one we haven't stored
+        cleaning = robot_status.get('cleaning') or {}
+        map_id = cleaning.get('mapId')
+        boundary_id = (cleaning.get('boundary') or {}).get('id')
+        if map_id and not self.maps.known(self.serial, map_id, boundary_id) and self.maps_breaker.allow():
+            self.task(self.sync_maps, key='maps', priority=PRIORITY_STATUS)
 
-            if self.states['connected'] == False:
-                self.states['display'] = 'offline'
-                self.next_update = time.time() + self.frequency_idle
-            elif self.states['state'] == 'busy':
-                self.states['display'] = self.states['action']
-                self.next_update = time.time() + self.frequency_busy
+    #-------------------------------------------------------------------------------
+    def sync_maps(self, force=False):
+        try:
+            changed = self.maps.sync(self.serial, self.fetch_boundaries, force)
+        except (NeatoException, RequestException, KeyError) as e:
+            # polls keep reporting the unknown map, so wait before asking the cloud again
+            if self.maps_breaker.failure():
+                self.logger.error(f'"{self.name}" unable to update maps: {e}')
             else:
-                self.states['display'] = self.states['state']
-                self.next_update = time.time() + self.frequency_idle
-            self.states['display'] = self.states['display'].replace('_',' ')
-
-            if self.states['state'] in ['invalid','error'] or self.states['connected'] == False:
-                stateImg = indigo.kStateImageSel.SensorTripped
-            elif self.states['state'] == 'busy':
-                stateImg = indigo.kStateImageSel.SensorOn
-            else: # idle, paused
-                stateImg = indigo.kStateImageSel.SensorOff
-
-            self.device.updateStatesOnServer([{'key':key,'value':self.states[key]} for key in self.states])
+                self.logger.debug(f'"{self.name}" still unable to update maps: {e}')
+        else:
+            self.maps_breaker.success()
+            if changed:
+                self.logger.info(f'"{self.name}" updated {changed} stored map(s)')
+            else:
+                self.logger.debug(f'"{self.name}" stored maps unchanged')
+
+    #-------------------------------------------------------------------------------
+    def fetch_boundaries(self, map_id):
+        if self.robot is None:
+            raise NeatoException('robot is not connected')
+        return self.robot.get_map_boundaries(map_id).json()['data']['boundaries']
+
+    #-------------------------------------------------------------------------------
+    def detect_events(self, reported):
+        # compare with the last robot report so each transition fires once
+        previous = self.reported
+        current = self.reported = dict(previous, **reported)
+        events = list()
+        if current['connected'] and previous['connected'] is not None:
+            was_cleaning = previous['state'] in ['busy','paused'] and previous['action'] in k_cleaning_actions
+            is_cleaning = current['state'] in ['busy','paused'] and current['action'] in k_cleaning_actions
+            if is_cleaning and not was_cleaning:
+                events.append('cleaning_started')
+            elif was_cleaning and not is_cleaning:
+                events.append('cleaning_finished')
+            if current['docked'] and not previous['docked']:
+                events.append('docked')
+            if current['error'] and current['error'] != previous['error']:
+                events.append('error_raised')
+            elif previous['error'] and not current['error']:
+                events.append('error_cleared')
+            if current['batteryLevel'] < previous['batteryLevel']:
+                events.append('battery_low')
+        elif previous['connected'] and not current['connected']:
+            events.append('went_offline')
+        if events:
+            self.logger.debug(f'"{self.name}" events: {", ".join(events)}')
+            self.fireEvents(self.device.id, events, previous, current)
+
+    #-------------------------------------------------------------------------------
+    def update_display(self):
+        if self.states['connected'] == False:
+            self.states['display'] = 'offline'
+        elif self.states['state'] == 'busy':
+            self.states['display'] = self.states['action']
+        else:
+            self.states['display'] = self.states['state']
+        self.states['display'] = self.states['display'].replace('_',' ')
+
+    #-------------------------------------------------------------------------------
+    def confirm(self, expected):
+        # show the expected result now and poll quickly until the robot reports it
+        # (an earlier confirmation's overlay is not what the robot last reported)
+        reported = dict(self.states, **self.expect_from)
+        self.expect_from = {key:reported.get(key) for key in expected}
+        self.expected = expected
+        self.expect_deadline = time.time() + CONFIRM_TIMEOUT_SECONDS
+        self.confirm_delay = CONFIRM_FIRST_SECONDS
+        self.states.update(expected)
+        self.update_display()
+        self.publish_states()
+        if not self.cancelled:
+            self.next_update = time.time() + self.confirm_delay
+            self.scheduler.schedule(self, self.next_update)
+
+    #-------------------------------------------------------------------------------
+    def check_expected(self, states):
+        if not self.expected:
+            return
+        if all(states.get(key) == value for key, value in self.expected.items()):
+            self.logger.debug(f'"{self.name}" command confirmed')
+        elif any(states.get(key) != value for key, value in self.expect_from.items()):
+            # the robot moved on to something else, so show what it reports
+            self.logger.info(f'"{self.name}" command superseded by robot state {states.get("state")}')
+        elif time.time() < self.expect_deadline:
+            # the cloud has not caught up yet, so keep showing the expected states
+            states.update(self.expected)
+            return
+        else:
+            self.logger.info(f'"{self.name}" command not confirmed by robot')
+        self.expected = dict()
+        self.expect_from = dict()
+
+    #-------------------------------------------------------------------------------
+    def force_status(self):
+        self.force_update = True
+        self.task(self.request_status, key=STATUS_TASK, priority=PRIORITY_STATUS)
+
+    #-------------------------------------------------------------------------------
+    def hydrate(self, stale):
+        # start from the last-known states Indigo kept for the device
+        for key in self.states:
+            if key in self.device.states:
+                self.states[key] = self.device.states[key]
+        self.published = dict(self.states)
+        self.reported = {key:self.states[key] for key in k_event_states}
+        if not self.device.states:
+            # a new device has nothing to compare the first report with
+            self.reported['connected'] = None
+        self.stale = stale
+        self.states['stale'] = stale
+        if stale:
+            self.publish_states()
+
+    #-------------------------------------------------------------------------------
+    def publish_states(self, force=False):
+        stateImg = self.state_image
+        # only send states that changed since they were last published
+        if force:
+            changed = dict(self.states)
+        else:
+            changed = {key:value for key,value in self.states.items() if key not in self.published or self.published[key] != value}
+        if changed:
+            self.device.updateStatesOnServer([{'key':key,'value':value} for key,value in changed.items()])
+            self.published.update(changed)
+        if force or stateImg != self.published_image:
             self.device.updateStateImageOnServer(stateImg)
+            self.published_image = stateImg
+        self.logger.debug(f'"{self.name}" published {len(changed)} changed states')
 
-        self.logger.debug(f'"{self.name}" status update complete')
+    #-------------------------------------------------------------------------------
+    def next_interval(self, changed):
+        if self.states['connected'] and self.states['state'] == 'busy':
+            interval = self.frequency_busy
+        else:
+            interval = self.frequency_idle
+        if not self.adaptive:
+            return interval
+
+        # poll fast while the robot is changing or an automation is waiting on it
+        if changed or (time.time() - self.command_time < ADAPTIVE_SETTLE_SECONDS) \
+                or self.states['state'] == 'paused' or self.states['action'] in k_robot_transitional_actions:
+            self.backoff = 1
+            return min(interval, ADAPTIVE_FAST_SECONDS)
+
+        # back off exponentially while resting on the dock with a full charge
+        if self.resting:
+            interval = min(self.frequency_idle * self.backoff, max(ADAPTIVE_MAX_SECONDS, self.frequency_idle))
+            if interval < ADAPTIVE_MAX_SECONDS:
+                self.backoff *= 2
+            return interval
+
+        self.backoff = 1
+        return interval
 
     #-------------------------------------------------------------------------------
     # properties
@@ -508,198 +2086,239 @@ class Botvac(threading.Thread):
     def name(self):
         return self.device.name
 
+    #-------------------------------------------------------------------------------
+    @property
+    def state_image(self):
+        if self.states['state'] in ['invalid','error'] or self.states['connected'] == False:
+            return indigo.kStateImageSel.SensorTripped
+        elif self.states['state'] == 'busy':
+            return indigo.kStateImageSel.SensorOn
+        else: # idle, paused
+            return indigo.kStateImageSel.SensorOff
+
+    #-------------------------------------------------------------------------------
+    @property
+    def transition_key(self):
+        return (self.states['connected'], self.states['state'], self.states['action'],
+                self.states['docked'], self.states['charging'], self.states['error'])
+
+    #-------------------------------------------------------------------------------
+    @property
+    def resting(self):
+        return (self.states['connected'] and self.states['state'] == 'idle' and self.states['docked']
+                and not self.states['charging'] and self.states['batteryLevel'] >= 100)
+
     #-------------------------------------------------------------------------------
     # action methods
     #-------------------------------------------------------------------------------
     def start_cleaning(self, props):
-        if self.available_commands.get('start',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" start house cleaning')
-                self.robot.start_cleaning(mode=int(props['mode']), navigation_mode=int(props['navigation']), category=int(props['map']))
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" start cleaning command not currently available')
+        return self.run_command('start house cleaning', 'start',
+                                lambda: self.robot.start_cleaning(mode=int(props['mode']), navigation_mode=int(props['navigation']),
+                                                                  category=int(props['map'])),
+                                {'state':'busy', 'action':'house_cleaning'})
 
     #-------------------------------------------------------------------------------
     def start_spot_cleaning(self, props):
-        if self.available_commands.get('start',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" start spot cleaning')
-                self.robot.start_spot_cleaning(spot_width=int(props['width']), spot_height=int(props['height']))
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" start cleaning command not currently available')
+        return self.run_command('start spot cleaning', 'start',
+                                lambda: self.robot.start_spot_cleaning(spot_width=int(props['width']), spot_height=int(props['height'])),
+                                {'state':'busy', 'action':'spot_cleaning'})
+
+    #-------------------------------------------------------------------------------
+    def start_room_cleaning(self, props):
+        target = self.maps.resolve(self.serial, props['room'])
+        if not target:
+            self.logger.error(f'"{self.name}" room "{props["room"]}" not found in stored maps')
+            return False
+        map_id, boundary_id = target
+        return self.run_command(f'start cleaning {props["room"]}', 'start',
+                                lambda: self.robot.start_cleaning(mode=int(props['mode']), navigation_mode=int(props['navigation']),
+                                                                  category=4, boundary_id=boundary_id, map_id=map_id),
+                                {'state':'busy', 'category':'room'})
 
     #-------------------------------------------------------------------------------
     def pause_cleaning(self):
-        if self.available_commands.get('pause',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" pause cleaning')
-                self.robot.pause_cleaning()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" pause cleaning command not currently available')
+        return self.run_command('pause cleaning', 'pause', lambda: self.robot.pause_cleaning(), {'state':'paused'})
 
     #-------------------------------------------------------------------------------
     def resume_cleaning(self):
-        if self.available_commands.get('resume',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" resume cleaning')
-                self.robot.resume_cleaning()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" resume cleaning command not currently available')
+        return self.run_command('resume cleaning', 'resume', lambda: self.robot.resume_cleaning(), {'state':'busy'})
 
     #-------------------------------------------------------------------------------
     def stop_cleaning(self):
-        if self.available_commands.get('stop',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" stop cleaning')
-                self.robot.stop_cleaning()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" stop cleaning command not currently available')
+        return self.run_command('stop cleaning', 'stop', lambda: self.robot.stop_cleaning(), {'state':'idle', 'action':'none'})
 
     #-------------------------------------------------------------------------------
     def send_to_base(self):
-        if self.available_commands.get('goToBase',False) and self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" go to base')
-                self.robot.send_to_base()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" go to base command not currently available')
+        return self.run_command('go to base', 'goToBase', lambda: self.robot.send_to_base(), {'state':'busy', 'action':'docking'})
 
     #-------------------------------------------------------------------------------
     def locate(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" locate')
-                self.robot.locate()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" locate command not currently available')
+        return self.run_command('locate', None, lambda: self.robot.locate())
 
     #-------------------------------------------------------------------------------
     def enable_schedule(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" enable schedule')
-                self.robot.enable_schedule()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-            self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" enable schedule command not currently available')
+        return self.run_command('enable schedule', None, lambda: self.robot.enable_schedule(), {'schedule_enabled':True})
 
     #-------------------------------------------------------------------------------
     def disable_schedule(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" disable schedule')
-                self.robot.disable_schedule()
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
+        return self.run_command('disable schedule', None, lambda: self.robot.disable_schedule(), {'schedule_enabled':False})
+
+    #-------------------------------------------------------------------------------
+    def run_command(self, label, command, send, expected=None):
+        # check against a fresh status, then send; returns None while a retry is pending
+        if not self.command_available(command):
+            self.logger.error(f'"{self.name}" {label} command not currently available')
+            self.report_command(label, 'unavailable')
+            self.publish_states()
+            return False
+        return self.send_command(label, command, send, expected, 0)
+
+    #-------------------------------------------------------------------------------
+    def retry_command(self, label, command, send, expected, attempt):
+        if self.cancelled:
+            return False
+        if expected:
+            # the failed attempt may still have reached the robot, so look before sending again
+            self.apply_status(*self.fetch_status())
+            if self.states['connected'] and all(self.states.get(key) == value for key, value in expected.items()):
+                self.logger.info(f'"{self.name}" {label} took effect')
+                self.report_command(label, 'success')
+                self.publish_states()
+                return True
+            if not self.command_available(command, refresh=False):
+                self.logger.error(f'"{self.name}" {label} command no longer available')
+                self.report_command(label, 'unavailable')
+                self.publish_states()
+                return False
+        return self.send_command(label, command, send, expected, attempt)
+
+    #-------------------------------------------------------------------------------
+    def send_command(self, label, command, send, expected, attempt):
+        try:
+            self.logger.info(f'"{self.name}" {label}')
+            send()
+            self.command_time = time.time()
+        except (NeatoException, RequestException) as e:
+            if transient_error(e) and attempt + 1 < COMMAND_ATTEMPTS:
+                # queue the retry rather than hold a worker while backing off
+                delay = COMMAND_RETRY_SECONDS * 2**attempt * random.uniform(1, 1.5)
+                self.logger.warning(f'"{self.name}" {label} communication error: {e}')
+                self.logger.info(f'"{self.name}" retrying {label} in {delay:.1f} seconds')
+                self.report_command(label, 'retrying')
+                self.publish_states()
+                self.scheduler.schedule_task(self, time.time() + delay, self.retry_command,
+                                             label, command, send, expected, attempt + 1)
+                return None
+            self.logger.error(f'"{self.name}" {label} failed: {e}')
+            self.report_command(label, 'failed')
             self.request_status()
+            return False
+        self.report_command(label, 'success')
+        if expected:
+            self.confirm(expected)
         else:
-            self.logger.error(f'"{self.name}" disable schedule command not currently available')
+            self.request_status()
+        return True
 
     #-------------------------------------------------------------------------------
-    def get_schedule(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" get schedule')
-                result_dict = self.robot.get_schedule().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-                self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get schedule command not currently available')
+    def command_available(self, command, refresh=True):
+        # available commands come from the last status, which may be too old to trust;
+        # a hydrated 'connected' is only what Indigo last showed, so a robot is needed too
+        if refresh and time.time() - self.status_time > COMMAND_RECHECK_SECONDS:
+            if time.time() - self.status_time > COMMAND_STATUS_SECONDS or not self.command_ready(command):
+                self.logger.debug(f'"{self.name}" refreshing available commands')
+                self.apply_status(*self.fetch_status())
+        return self.command_ready(command)
 
     #-------------------------------------------------------------------------------
-    def get_general_info(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" get general info')
-                result_dict = self.robot.get_general_info().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-                self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get general info command not currently available')
+    def command_ready(self, command):
+        return self.robot is not None and self.states['connected'] and \
+               (command is None or self.available_commands.get(command,False))
 
     #-------------------------------------------------------------------------------
-    def get_local_stats(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" get local stats')
-                result_dict = self.robot.get_local_stats().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-                self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get local stats command not currently available')
+    def report_command(self, label, result):
+        self.states['last_command'] = label
+        self.states['command_result'] = result
 
     #-------------------------------------------------------------------------------
-    def get_preferences(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" get preferences')
-                result_dict = self.robot.get_preferences().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-                self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get preferences command not currently available')
+    def get_schedule(self, props=None):
+        return self.get_info('schedule', props)
 
     #-------------------------------------------------------------------------------
-    def get_map_boundaries(self):
-        if self.states['connected']:
-            try:
-                self.logger.info(f'"{self.name}" get map boundaries')
-                result_dict = self.robot.get_map_boundaries().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
-                self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get map boundaries command not currently available')
+    def get_general_info(self, props=None):
+        return self.get_info('general_info', props)
+
+    #-------------------------------------------------------------------------------
+    def get_local_stats(self, props=None):
+        return self.get_info('local_stats', props)
+
+    #-------------------------------------------------------------------------------
+    def get_preferences(self, props=None):
+        return self.get_info('preferences', props)
+
+    #-------------------------------------------------------------------------------
+    def get_map_boundaries(self, props=None):
+        return self.get_info('map_boundaries', props)
 
     #-------------------------------------------------------------------------------
-    def get_robot_info(self):
-        if self.states['connected']:
+    def get_robot_info(self, props=None):
+        return self.get_info('robot_info', props)
+
+    #-------------------------------------------------------------------------------
+    def get_info(self, endpoint, props=None):
+        # informational endpoints change rarely, so answer from cache when fresh enough
+        props = props or dict()
+        label = endpoint.replace('_',' ')
+        if self.robot is None or not self.states['connected']:
+            self.logger.error(f'"{self.name}" get {label} command not currently available')
+            return None
+
+        max_age = int(props.get('maxAge', k_info_max_age[endpoint]))
+        cached = self.info_cache.get(endpoint)
+        if cached and not props.get('refresh',False) and time.time() - cached[0] < max_age:
+            self.logger.info(f'"{self.name}" get {label} (cached)')
+            result_dict = cached[1]
+        else:
             try:
-                self.logger.info(f'"{self.name}" get robot info')
-                result_dict = self.robot.get_robot_info().json()
-                self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
-            except RequestException:
-                self.logger.error(f'"{self.name}" communication error')
+                self.logger.info(f'"{self.name}" get {label}')
+                result_dict = getattr(self.robot, f'get_{endpoint}')().json()
+            except (NeatoException, RequestException) as e:
+                self.logger.error(f'"{self.name}" get {label} communication error: {e}')
                 self.request_status()
-        else:
-            self.logger.error(f'"{self.name}" get robot info command not currently available')
+                return None
+            self.info_cache[endpoint] = (time.time(), result_dict)
+            self.states[f'{endpoint}_data'] = json.dumps(result_dict, sort_keys=True)
+            self.publish_states()
+        self.logger.info(f"{json.dumps(result_dict, sort_keys=True, indent=4)}")
+        return result_dict
 
 
 ################################################################################
 # Utilities
 ################################################################################
+def restore_session(token, vendor):
+    # a PasswordSession authenticated with a cached token instead of a login
+    session = PasswordSession.__new__(PasswordSession)
+    super(PasswordSession, session).__init__(vendor=vendor)
+    session.headers['Authorization'] = f'Token token={token}'
+    return session
+
+#-------------------------------------------------------------------------------
+def transient_error(error):
+    # pybotvac wraps connection and HTTP errors in NeatoRobotException
+    cause = error.__cause__ if isinstance(error, NeatoException) and error.__cause__ else error
+    if isinstance(cause, requests.exceptions.HTTPError) and cause.response is not None:
+        return cause.response.status_code >= 500 or cause.response.status_code == 429
+    return isinstance(cause, RequestException)
+
+#-------------------------------------------------------------------------------
+def auth_error(error):
+    # a rejected session token, as opposed to a cloud or network failure
+    cause = error.__cause__ if isinstance(error, NeatoException) and error.__cause__ else error
+    return isinstance(cause, requests.exceptions.HTTPError) and cause.response is not None \
+           and cause.response.status_code in (401, 403)
+
+#-------------------------------------------------------------------------------
 def validateTextFieldNumber(rawInput, numType=float, zero=True, negative=True):
     try:
         num = numType(rawInput)
@@ -0,0 +1,219 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+'''
+Benchmarks for the plugin's hot paths, run in-process against the simulated
+cloud and stub indigo module:
+
+    status    parsing a state payload and building the state update
+    publish   building and sending changed states (and a forced full publish)
+    queue     task submission and execution throughput across robots
+    command   end-to-end command latency, action callback to robot
+    tick      CPU time per poll while runConcurrentThread drives the fleet
+    churn     deviceStartComm/deviceStopComm cycles
+
+    python3 tools/benchmark.py --robots 1,10,100
+
+Each run appends one JSON line per robot count to the results file, with the
+plugin version and git revision, so runs can be compared across updates.
+'''
+
+import os
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import plistlib
+
+os.environ.setdefault('NEATO_SIM_HOME', tempfile.mkdtemp(prefix='neato-bench-'))
+
+import neato_sim
+
+#-------------------------------------------------------------------------------
+def timed(func, count):
+    # mean microseconds per call
+    started = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - started) * 1e6 / count
+
+#-------------------------------------------------------------------------------
+def plugin_version():
+    try:
+        with open(os.path.join(neato_sim.PLUGIN_FOLDER, os.pardir, 'Info.plist'), 'rb') as f:
+            return plistlib.load(f).get('PluginVersion')
+    except (OSError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=neato_sim.TOOLS_FOLDER,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+################################################################################
+class Benchmark(object):
+    '''
+    One robot count: a harness with connected devices and the benchmarks.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, robots, iterations, workers):
+        self.robots = robots
+        self.iterations = iterations
+        self.cloud = neato_sim.SimCloud(robots, seed=1)
+        self.harness = neato_sim.SimHarness(self.cloud, prefs={'workerThreads': str(workers), 'pollStagger': '0'},
+                                            device_props={'statusFrequency': '3600', 'statusFrequencyBusy': '3600'})
+        logging.getLogger().setLevel(logging.WARNING)
+        self.harness.start(run=False)
+        self.harness.wait_connected()
+        self.plugin = self.harness.plugin
+        self.instances = list(self.plugin.instance_dict.values())
+        for instance in self.instances:
+            instance.request_status()
+        self.payloads = self.cloud.payloads
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        self.harness.stop()
+
+    #-------------------------------------------------------------------------------
+    def bench_status(self):
+        instance = self.instances[0]
+        payloads = self.payloads
+        def apply(i):
+            instance.apply_status(payloads[i % len(payloads)], None, time.time())
+        return {'apply_status_us': round(timed(apply, self.iterations), 1)}
+
+    #-------------------------------------------------------------------------------
+    def bench_publish(self):
+        instance = self.instances[0]
+        def changed(i):
+            instance.states['batteryLevel'] = i % 100
+            instance.publish_states()
+        def forced(i):
+            instance.publish_states(force=True)
+        return {
+            'publish_changed_us' : round(timed(changed, self.iterations), 1),
+            'publish_forced_us'  : round(timed(forced, self.iterations), 1),
+            }
+
+    #-------------------------------------------------------------------------------
+    def bench_queue(self):
+        done = threading.Event()
+        lock = threading.Lock()
+        total = self.iterations * len(self.instances)
+        count = [0]
+        def work():
+            with lock:
+                count[0] += 1
+                if count[0] == total:
+                    done.set()
+        started = time.perf_counter()
+        for i in range(self.iterations):
+            for instance in self.instances:
+                instance.task(work)
+        submitted = time.perf_counter()
+        done.wait(60)
+        finished = time.perf_counter()
+        return {
+            'submit_us'      : round((submitted - started) * 1e6 / total, 1),
+            'tasks_per_sec'  : round(count[0] / (finished - started)),
+            }
+
+    #-------------------------------------------------------------------------------
+    def bench_command(self):
+        latencies = list()
+        for i in range(min(self.iterations, 200)):
+            instance = self.instances[i % len(self.instances)]
+            robot = self.cloud.robots[instance.serial]
+            count = len(robot.commands)
+            sent = time.perf_counter()
+            self.plugin.locate(neato_sim.SimAction(instance.device.id))
+            deadline = sent + 10
+            while len(robot.commands) == count and time.perf_counter() < deadline:
+                time.sleep(0)
+            latencies.append(time.perf_counter() - sent)
+        latencies.sort()
+        return {
+            'command_mean_ms' : round(statistics.mean(latencies) * 1000, 3),
+            'command_p95_ms'  : round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+            }
+
+    #-------------------------------------------------------------------------------
+    def bench_tick(self, seconds=3):
+        for instance in self.instances:
+            instance.frequency_idle = instance.frequency_busy = 1
+            self.plugin.scheduler.schedule(instance, time.time())
+        polls = self.cloud.calls['state']
+        cpu = time.process_time()
+        thread = threading.Thread(target=self.plugin.runConcurrentThread, name='runConcurrentThread')
+        thread.daemon = True
+        thread.start()
+        time.sleep(seconds)
+        self.plugin.stopConcurrentThread()
+        thread.join(5)
+        polls = self.cloud.calls['state'] - polls
+        cpu = time.process_time() - cpu
+        return {
+            'polls_per_sec'  : round(polls / seconds, 1),
+            'cpu_per_poll_us': round(cpu * 1e6 / polls, 1) if polls else None,
+            }
+
+    #-------------------------------------------------------------------------------
+    def bench_churn(self):
+        devices = list(self.harness.devices.values())
+        def cycle(i):
+            dev = devices[i % len(devices)]
+            self.plugin.deviceStopComm(dev)
+            self.plugin.deviceStartComm(dev)
+        return {'start_stop_us': round(timed(cycle, min(self.iterations, 1000)), 1)}
+
+    #-------------------------------------------------------------------------------
+    def run(self, names):
+        results = dict()
+        for name in names:
+            results[name] = getattr(self, f'bench_{name}')()
+        return results
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the plugin hot paths against a simulated cloud.')
+    parser.add_argument('--robots', default='1,10,100', help='comma separated robot counts')
+    parser.add_argument('--iterations', type=int, default=1000, help='iterations per benchmark')
+    parser.add_argument('--workers', type=int, default=4, help='plugin worker threads')
+    parser.add_argument('--only', help='comma separated benchmarks to run (status,publish,queue,command,tick,churn)')
+    parser.add_argument('--output', default=os.path.join(neato_sim.TOOLS_FOLDER, 'benchmark_results.jsonl'),
+                        help='results file to append to (default tools/benchmark_results.jsonl)')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else ['status', 'publish', 'queue', 'command', 'tick', 'churn']
+    record = {
+        'time'     : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version'  : plugin_version(),
+        'revision' : git_revision(),
+        'python'   : platform.python_version(),
+        'machine'  : platform.machine(),
+        'workers'  : args.workers,
+        }
+    with open(args.output, 'a') as f:
+        for robots in [int(count) for count in args.robots.split(',')]:
+            benchmark = Benchmark(robots, args.iterations, args.workers)
+            try:
+                results = benchmark.run(names)
+            finally:
+                benchmark.close()
+            print(f'{robots} robots')
+            for name, values in results.items():
+                print(f'    {name:8} ' + ', '.join(f'{key} {value}' for key, value in values.items()))
+            f.write(json.dumps(dict(record, robots=robots, results=results), sort_keys=True) + '\n')
+
+if __name__ == '__main__':
+    main()
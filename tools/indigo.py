@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+'''
+Minimal stand-in for the Indigo server's `indigo` module, covering only what
+plugin.py uses, so the plugin can run headless under the simulator and
+benchmarks.  Plugin files are written under NEATO_SIM_HOME (a temporary
+folder by default).
+'''
+
+import os
+import time
+import logging
+import tempfile
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(message)s')
+
+################################################################################
+class _Server(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.home = os.environ.get('NEATO_SIM_HOME') or tempfile.mkdtemp(prefix='neato-sim-')
+        self.logger = logging.getLogger('Indigo')
+        self.saved_prefs = 0
+
+    #-------------------------------------------------------------------------------
+    def log(self, message, isError=False):
+        if isError:
+            self.logger.error(message)
+        else:
+            self.logger.info(message)
+
+    #-------------------------------------------------------------------------------
+    def getInstallFolderPath(self):
+        return self.home
+
+    #-------------------------------------------------------------------------------
+    def savePluginPrefs(self):
+        self.saved_prefs += 1
+
+server = _Server()
+
+################################################################################
+class _TriggerCommands(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.executed = list()
+
+    #-------------------------------------------------------------------------------
+    def execute(self, trigger):
+        self.executed.append((trigger.id, trigger.pluginTypeId, time.time()))
+
+trigger = _TriggerCommands()
+
+################################################################################
+class Dict(dict):
+    pass
+
+class List(list):
+    pass
+
+class kStateImageSel(object):
+    SensorOff     = 'SensorOff'
+    SensorOn      = 'SensorOn'
+    SensorTripped = 'SensorTripped'
+
+class kUniversalAction(object):
+    RequestStatus = 'RequestStatus'
+
+################################################################################
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger('Plugin')
+        self.debug = False
+        self.stopThread = False
+
+    #-------------------------------------------------------------------------------
+    def sleep(self, seconds):
+        end = time.time() + seconds
+        while True:
+            if self.stopThread:
+                raise self.StopThread()
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.05))
+
+    #-------------------------------------------------------------------------------
+    def stopConcurrentThread(self):
+        self.stopThread = True
+
+################################################################################
+class Trigger(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, id, pluginTypeId, pluginProps=None):
+        self.id = id
+        self.pluginTypeId = pluginTypeId
+        self.pluginProps = Dict(pluginProps or {})
+
+################################################################################
+class Device(object):
+    '''
+    A plugin device.  Counts server updates so callers can measure publishing.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, id, name, pluginProps, deviceTypeId='botvac'):
+        self.id = id
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.pluginProps = Dict(pluginProps)
+        self.configured = True
+        self.version = pluginProps.get('version')
+        self.states = Dict()
+        self.errorState = None
+        self.stateImage = None
+        self.state_updates = 0
+        self.state_values = 0
+
+    #-------------------------------------------------------------------------------
+    def updateStatesOnServer(self, stateList):
+        self.state_updates += 1
+        self.state_values += len(stateList)
+        for item in stateList:
+            self.states[item['key']] = item['value']
+
+    #-------------------------------------------------------------------------------
+    def updateStateImageOnServer(self, image):
+        self.stateImage = image
+
+    #-------------------------------------------------------------------------------
+    def setErrorStateOnServer(self, error):
+        self.errorState = error
+
+    #-------------------------------------------------------------------------------
+    def replacePluginPropsOnServer(self, props):
+        self.pluginProps = Dict(props)
+        self.version = props.get('version')
+
+    #-------------------------------------------------------------------------------
+    def stateListOrDisplayStateIdChanged(self):
+        pass
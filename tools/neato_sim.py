@@ -0,0 +1,430 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+'''
+Local stand-in for the Neato cloud and the pybotvac session/Robot surface.
+
+Robots replay recorded `state` payloads (a JSON list, or one payload per line)
+with configurable latency, error rate and fleet size.  Commands switch a robot
+into a matching state for a while before the replay resumes.  Together with the
+stub `indigo` module in this folder, the plugin runs headless:
+
+    python3 tools/neato_sim.py --robots 25 --latency 0.2 --errors 0.05 --duration 60
+
+Payloads for replay can be captured from a real robot with the plugin's debug
+logging, or with pybotvac directly (`json.dumps(robot.state)`).
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import statistics
+import collections
+
+import requests
+
+TOOLS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_FOLDER = os.path.join(TOOLS_FOLDER, os.pardir, 'Neato Botvac.indigoPlugin', 'Contents', 'Server Plugin')
+
+################################################################################
+# globals
+k_idle_payload = {
+    'version': 1,
+    'state': 1,
+    'action': 0,
+    'error': None,
+    'alert': None,
+    'cleaning': {'category': 4, 'mode': 1, 'modifier': 1, 'navigationMode': 1, 'spotWidth': 0, 'spotHeight': 0},
+    'details': {'isCharging': False, 'isDocked': True, 'isScheduleEnabled': True, 'dockHasBeenSeen': True, 'charge': 100},
+    'availableCommands': {'start': True, 'stop': False, 'pause': False, 'resume': False, 'goToBase': False},
+    'availableServices': {'houseCleaning': 'basic-4', 'spotCleaning': 'basic-3', 'manualCleaning': 'basic-1',
+                          'maps': 'basic-2', 'schedule': 'basic-2'},
+    'meta': {'modelName': 'BotVacD7Connected', 'firmware': '4.5.3-189'},
+    }
+k_command_states = {
+    'start_cleaning'      : {'state': 2, 'action': 1, 'commands': {'pause': True, 'stop': True, 'goToBase': True}},
+    'start_spot_cleaning' : {'state': 2, 'action': 2, 'commands': {'pause': True, 'stop': True, 'goToBase': True}},
+    'pause_cleaning'      : {'state': 3, 'action': 1, 'commands': {'resume': True, 'stop': True, 'goToBase': True}},
+    'resume_cleaning'     : {'state': 2, 'action': 1, 'commands': {'pause': True, 'stop': True, 'goToBase': True}},
+    'stop_cleaning'       : {'state': 1, 'action': 0, 'commands': {'start': True}},
+    'send_to_base'        : {'state': 2, 'action': 4, 'commands': {'pause': True, 'stop': True}},
+    }
+COMMAND_HOLD_POLLS = 10
+
+#-------------------------------------------------------------------------------
+def default_payloads():
+    # a short cleaning cycle: docked, cleaning the kitchen, returning, charging
+    payloads = [json.loads(json.dumps(k_idle_payload))]
+    for charge in range(95, 55, -5):
+        busy = json.loads(json.dumps(k_idle_payload))
+        busy.update(state=2, action=11)
+        busy['cleaning']['boundary'] = {'id': 'kitchen', 'name': 'Kitchen'}
+        busy['cleaning']['mapId'] = 'home'
+        busy['details'].update(isDocked=False, charge=charge)
+        busy['availableCommands'] = {'start': False, 'stop': True, 'pause': True, 'resume': False, 'goToBase': True}
+        payloads.append(busy)
+    docking = json.loads(json.dumps(payloads[-1]))
+    docking['action'] = 4
+    payloads.append(docking)
+    for charge in range(60, 100, 10):
+        charging = json.loads(json.dumps(k_idle_payload))
+        charging['details'].update(isCharging=True, charge=charge)
+        payloads.append(charging)
+    return payloads
+
+#-------------------------------------------------------------------------------
+def load_payloads(path):
+    with open(path) as f:
+        text = f.read()
+    try:
+        payloads = json.loads(text)
+    except ValueError:
+        payloads = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(payloads, dict):
+        payloads = [payloads]
+    return payloads
+
+################################################################################
+class SimNeatoException(Exception):
+    pass
+
+################################################################################
+class SimResponse(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, data):
+        self.data = data
+
+    #-------------------------------------------------------------------------------
+    def json(self):
+        return self.data
+
+################################################################################
+class SimCloud(object):
+    '''
+    The simulated cloud: robots, injected latency and errors, and call counts.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, robots=3, latency=0.0, error_rate=0.0, payloads=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payloads = payloads or default_payloads()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.call_times = list()
+        self.robots = collections.OrderedDict()
+        for i in range(robots):
+            serial = f'SIM{i:04d}'
+            self.robots[serial] = SimRobot(self, serial, f'Botvac {i+1}', offset=i)
+
+    #-------------------------------------------------------------------------------
+    def call(self, endpoint):
+        with self.lock:
+            delay = self.latency * self.random.uniform(0.5, 1.5) if self.latency else 0
+            failed = self.random.random() < self.error_rate
+            self.calls[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            self.call_times.append(delay)
+        if failed:
+            raise requests.exceptions.ConnectionError(f'simulated {endpoint} failure')
+
+    #-------------------------------------------------------------------------------
+    def robot_list(self):
+        return [{'serial': robot.serial, 'name': robot.name, 'secret_key': 'secret', 'traits': [],
+                 'nucleo_url': 'https://nucleo.neatocloud.invalid'} for robot in self.robots.values()]
+
+    #-------------------------------------------------------------------------------
+    def install(self, module):
+        # point the plugin's pybotvac names at this cloud
+        cloud = self
+
+        class SimSession(object):
+            def __init__(self, email=None, password=None, vendor=None):
+                self.headers = {}
+                if email is not None:
+                    cloud.call('login')
+                    self.headers['Authorization'] = 'Token token=simulated'
+            def get(self, path, **kwargs):
+                cloud.call(path)
+                if path.endswith('/persistent_maps'):
+                    return SimResponse([{'id': 'home', 'name': 'Home', 'url': f'https://maps.invalid/{time.time()}'}])
+                return SimResponse(cloud.robot_list())
+
+        class SimPasswordSession(SimSession):
+            pass
+
+        def SimRobotFactory(serial, secret, traits=None, vendor=None, name='', endpoint='', **kwargs):
+            robot = cloud.robots.get(serial)
+            if robot is None:
+                raise module.NeatoException(f'unknown robot {serial}')
+            robot.state
+            return robot
+
+        module.PasswordSession = SimPasswordSession
+        module.Robot = SimRobotFactory
+        module.Neato = lambda: None
+        if not hasattr(module, 'NeatoException'):
+            module.NeatoException = SimNeatoException
+        return self
+
+    #-------------------------------------------------------------------------------
+    @property
+    def mean_latency(self):
+        with self.lock:
+            return statistics.mean(self.call_times) if self.call_times else 0
+
+################################################################################
+class SimRobot(object):
+    '''
+    A robot replaying payloads.  Commands hold a matching state for a while.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, cloud, serial, name, offset=0):
+        self.cloud = cloud
+        self.serial = serial
+        self.name = name
+        self.traits = []
+        self.has_persistent_maps = True
+        self.position = offset
+        self.override = None
+        self.hold = 0
+        self.commands = list()
+
+    #-------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'SimRobot({self.serial})'
+
+    #-------------------------------------------------------------------------------
+    @property
+    def state(self):
+        self.cloud.call('state')
+        if self.hold > 0:
+            self.hold -= 1
+            return json.loads(json.dumps(self.override))
+        payloads = self.cloud.payloads
+        payload = payloads[self.position % len(payloads)]
+        self.position += 1
+        return json.loads(json.dumps(payload))
+
+    #-------------------------------------------------------------------------------
+    def command(self, name, result=None):
+        self.cloud.call(name)
+        self.commands.append((name, time.time()))
+        if name in k_command_states:
+            change = k_command_states[name]
+            payload = json.loads(json.dumps(k_idle_payload))
+            payload.update(state=change['state'], action=change['action'])
+            payload['details']['isDocked'] = change['state'] == 1
+            payload['availableCommands'] = dict({key: False for key in payload['availableCommands']}, **change['commands'])
+            self.override = payload
+            self.hold = COMMAND_HOLD_POLLS
+        return SimResponse(result if result is not None else {'result': 'ok'})
+
+    #-------------------------------------------------------------------------------
+    def start_cleaning(self, mode=2, navigation_mode=1, category=None, boundary_id=None, map_id=None):
+        return self.command('start_cleaning')
+
+    def start_spot_cleaning(self, spot_width=400, spot_height=400, mode=2, modifier=2):
+        return self.command('start_spot_cleaning')
+
+    def pause_cleaning(self):
+        return self.command('pause_cleaning')
+
+    def resume_cleaning(self):
+        return self.command('resume_cleaning')
+
+    def stop_cleaning(self):
+        return self.command('stop_cleaning')
+
+    def send_to_base(self):
+        return self.command('send_to_base')
+
+    def locate(self):
+        return self.command('locate')
+
+    def enable_schedule(self):
+        return self.command('enable_schedule')
+
+    def disable_schedule(self):
+        return self.command('disable_schedule')
+
+    def dismiss_current_alert(self):
+        return self.command('dismiss_current_alert')
+
+    def get_schedule(self):
+        return self.command('get_schedule', {'data': {'enabled': True, 'events': []}})
+
+    def get_general_info(self):
+        return self.command('get_general_info', {'data': {'battery': {'level': 100}}})
+
+    def get_local_stats(self):
+        return self.command('get_local_stats', {'data': {'history': []}})
+
+    def get_preferences(self):
+        return self.command('get_preferences', {'data': {}})
+
+    def get_robot_info(self):
+        return self.command('get_robot_info', {'data': {'modelName': 'BotVacD7Connected'}})
+
+    def get_map_boundaries(self, map_id=None):
+        return self.command('get_map_boundaries', {'data': {'boundaries': [
+            {'id': 'kitchen', 'name': 'Kitchen', 'type': 'polygon', 'enabled': True},
+            {'id': 'office', 'name': 'Office', 'type': 'polygon', 'enabled': True},
+            {'id': 'stairs', 'name': '', 'type': 'polyline', 'enabled': True},
+            ]}})
+
+################################################################################
+class SimAction(object):
+    '''
+    The parts of an Indigo action the plugin's callbacks read.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, deviceId, props=None):
+        self.deviceId = deviceId
+        self.props = props or dict()
+
+################################################################################
+class SimHarness(object):
+    '''
+    A headless plugin wired to a simulated cloud, with one device per robot.
+    '''
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, cloud, prefs=None, device_props=None):
+        import indigo
+        self.indigo = indigo
+        self.module = load_plugin()
+        self.cloud = cloud.install(self.module)
+        plugin_prefs = indigo.Dict(email='simulated@example.com', password='simulated')
+        plugin_prefs.update(prefs or {})
+        self.plugin = self.module.Plugin('com.example.neato-simulator', 'Neato Botvac', '2023.0.0', plugin_prefs)
+        self.device_props = device_props or {}
+        self.devices = dict()
+        self.thread = None
+
+    #-------------------------------------------------------------------------------
+    def add_device(self, serial, dev_id=None):
+        dev_id = dev_id or 1000 + len(self.devices)
+        props = dict({'serial': serial, 'statusFrequency': '60', 'statusFrequencyBusy': '15'}, **self.device_props)
+        dev = self.indigo.Device(dev_id, self.cloud.robots[serial].name, props)
+        self.devices[dev_id] = dev
+        self.plugin.deviceStartComm(dev)
+        return dev
+
+    #-------------------------------------------------------------------------------
+    def remove_device(self, dev_id):
+        self.plugin.deviceStopComm(self.devices.pop(dev_id))
+
+    #-------------------------------------------------------------------------------
+    def start(self, run=True):
+        self.plugin.startup()
+        for serial in self.cloud.robots:
+            self.add_device(serial)
+        if not run:
+            return self
+        self.thread = threading.Thread(target=self.plugin.runConcurrentThread, name='runConcurrentThread')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        self.plugin.stopConcurrentThread()
+        if self.thread:
+            self.thread.join(5)
+        for dev_id in list(self.devices):
+            self.remove_device(dev_id)
+        self.plugin.shutdown()
+
+    #-------------------------------------------------------------------------------
+    def wait_connected(self, timeout=10):
+        end = time.time() + timeout
+        while time.time() < end and (self.plugin.connecting or not self.plugin.connected):
+            time.sleep(0.01)
+        return self.plugin.connected
+
+#-------------------------------------------------------------------------------
+def load_plugin():
+    for folder in [PLUGIN_FOLDER, TOOLS_FOLDER]:
+        if folder not in sys.path:
+            sys.path.insert(0, folder)
+    import plugin
+    return plugin
+
+#-------------------------------------------------------------------------------
+def run(args):
+    payloads = load_payloads(args.payloads) if args.payloads else None
+    cloud = SimCloud(args.robots, args.latency, args.errors, payloads, args.seed)
+    harness = SimHarness(cloud, prefs={'workerThreads': str(args.workers), 'pollStagger': str(args.frequency)},
+                         device_props={'statusFrequency': str(args.frequency), 'statusFrequencyBusy': str(args.frequency)})
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    started = time.time()
+    harness.start()
+    connected = harness.wait_connected()
+
+    # issue commands at the requested rate and time how long they wait in the queue
+    latencies = list()
+    deadline = started + args.duration
+    devices = list(harness.devices.values())
+    while time.time() < deadline:
+        if args.command_rate:
+            dev = random.choice(devices)
+            robot = cloud.robots[dev.pluginProps['serial']]
+            sent = time.time()
+            count = len(robot.commands)
+            harness.plugin.locate(SimAction(dev.id))
+            while len(robot.commands) == count and time.time() < deadline:
+                time.sleep(0.001)
+            if len(robot.commands) > count:
+                latencies.append(robot.commands[-1][1] - sent)
+            time.sleep(max(0, 1.0/args.command_rate - (time.time() - sent)))
+        else:
+            time.sleep(0.1)
+    elapsed = time.time() - started
+    offline = sum(1 for dev in devices if dev.errorState or not dev.states.get('connected'))
+    harness.stop()
+
+    print(f'robots:            {args.robots}')
+    print(f'connected:         {connected}')
+    print(f'elapsed:           {elapsed:.1f}s')
+    print(f'state calls:       {cloud.calls["state"]} ({cloud.calls["state"]/elapsed:.1f}/s)')
+    print(f'injected errors:   {sum(cloud.errors.values())}')
+    print(f'mean cloud delay:  {cloud.mean_latency*1000:.1f}ms')
+    print(f'state updates:     {sum(dev.state_updates for dev in devices)}')
+    print(f'offline at end:    {offline}')
+    if latencies:
+        latencies.sort()
+        print(f'command latency:   mean {statistics.mean(latencies)*1000:.1f}ms, '
+              f'p95 {latencies[int(len(latencies)*0.95)]*1000:.1f}ms ({len(latencies)} commands)')
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Run the plugin headless against a simulated Neato cloud.')
+    parser.add_argument('--robots', type=int, default=10, help='number of simulated robots')
+    parser.add_argument('--latency', type=float, default=0.1, help='mean cloud latency in seconds')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of cloud calls that fail')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--frequency', type=int, default=5, help='status frequency in seconds')
+    parser.add_argument('--workers', type=int, default=4, help='plugin worker threads')
+    parser.add_argument('--command-rate', type=float, default=1.0, help='commands per second (0 for none)')
+    parser.add_argument('--payloads', help='recorded state payloads to replay (JSON list or JSON lines)')
+    parser.add_argument('--seed', type=int, help='random seed for latency and errors')
+    parser.add_argument('--verbose', action='store_true', help='show the plugin log')
+    run(parser.parse_args())
+
+if __name__ == '__main__':
+    main()